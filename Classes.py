@@ -24,6 +24,12 @@ import re
 import time
 import itertools
 import string
+import heapq
+import copy
+import pickle
+import sys
+import threading
+from collections import OrderedDict
 
 from Functions import *
 from extractors.Events import extract_events
@@ -31,6 +37,7 @@ from extractors.Forms import extract_forms, parse_form
 from extractors.Urls import extract_urls
 from extractors.Iframes import extract_iframes
 from extractors.Ui_forms import extract_ui_forms
+from extractors.Snapshot import extract_snapshot, PropertyTracker
 
 import logging
 
@@ -43,14 +50,56 @@ for v in logging.Logger.manager.loggerDict.values():
     v.disabled = True
 
 
+# Urls, methods and xpaths repeat across thousands of objects, keep a
+# single copy of each string in the interpreter's intern table.
+def intern_str(s):
+    if isinstance(s, str):
+        return sys.intern(s)
+    return s
+
+
+# Base for the small data classes that are created for every link, form
+# input and event. Subclasses use __slots__ and cache their hash in _hash
+# the first time it is needed. The cached hash is never pickled (string
+# hashes differ between processes), it is recomputed after loading.
+class Slotted:
+    __slots__ = ()
+
+    # Fields the hash is computed from, assigning one of them drops the
+    # cached hash (e.g. SubmitElement.use after set_submits)
+    _hash_fields = ()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._hash_fields:
+            object.__setattr__(self, "_hash", None)
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name != "_hash" and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._hash = None
+
+
 # This should be the main class for nodes in the graph
 # Should contain GET/POST, Form data, cookies,
 # events too?
-class Request:
+class Request(Slotted):
+    __slots__ = ("url", "method", "_hash")
+    _hash_fields = ("url", "method")
+
     def __init__(self, url, method):
-        self.url = url
+        self.url = intern_str(url)
         # GET / POST
-        self.method = method
+        self.method = intern_str(method)
+        self._hash = None
 
         # Form data
         # self.forms = []
@@ -80,7 +129,9 @@ class Request:
         return False
 
     def __hash__(self):
-        return hash(self.url + self.method)
+        if self._hash is None:
+            self._hash = hash(self.url + self.method)
+        return self._hash
 
 
 class Graph:
@@ -89,12 +140,58 @@ class Graph:
         self.edges = []
         self.data = {}  # Meta data that can be used for anything
 
+        # Hash indexes over nodes and edges. The lists above keep the
+        # insertion order, these give O(1) membership and lookup.
+        # value -> Node
+        self.node_index = {}
+        # Edge -> Edge (the stored instance)
+        self.edge_index = {}
+        # Adjacency, value -> [Edge]
+        self.out_edges = {}
+        self.in_edges = {}
+
+        # Unvisited edges split by frontier kind (see frontier_kind),
+        # "all" holds every unvisited edge in insertion order.
+        self.frontier = {"all": Frontier()}
+
+        # GET edges are ranked by the url features (see link_key), they are
+        # computed once per edge, edge -> (path, depth, queries)
+        self.link_index = {}
+        # path -> [Edge], to re-rank when a path gets its first visit
+        self.link_paths = {}
+        # Url templates (see url_template), edge -> template
+        self.link_templates = {}
+        # template -> [Edge], to re-rank as the template gets visited
+        self.template_edges = {}
+
+        # DOM states reached by the crawled edges, see add_state
+        # (url, structural fingerprint) -> first Edge that reached it
+        self.states = {}
+        # Edge -> (url, structural fingerprint)
+        self.edge_states = {}
+        # Parent edge -> [Edge], the edges found in the state it led to
+        self.children = {}
+        # Edge -> ((url, structural fingerprint), cookie jar id, storage),
+        # what is needed to restore the state the edge led to without
+        # replaying its path, see restore_state in Functions.py
+        self.snapshots = {}
+
+        # Events that share a handler, see event_class
+        # class -> [Edge], in insertion order
+        self.event_classes = {}
+        # Event edges past the first representatives of their class
+        self.deferred_events = set()
+
     # Separate node class for storing meta data.
-    class Node:
+    class Node(Slotted):
+        __slots__ = ("value", "visited", "_hash")
+        _hash_fields = ("value",)
+
         def __init__(self, value):
             self.value = value
             # Meta data for algorithms
             self.visited = False
+            self._hash = None
 
         def __repr__(self):
             return str(self.value)
@@ -103,37 +200,112 @@ class Graph:
             return self.value == other.value
 
         def __hash__(self):
-            return hash(self.value)
+            if self._hash is None:
+                self._hash = hash(self.value)
+            return self._hash
+
+    class Edge(Slotted):
+        __slots__ = ("n1", "n2", "value", "visited", "parent", "seq",
+                     "depth", "dom_depth", "path_len", "_hash")
+        _hash_fields = ("n1", "n2", "value")
 
-    class Edge:
         # Value can be anything
         # For the crawler (type, data) is used,
         # where type = {"get", "form", "event"}
         # and   data = {None, data about form, data about event}
         def __init__(self, n1, n2, value, parent=None):
+            self._hash = None
             self.n1 = n1
             self.n2 = n2
             self.value = value
             self.visited = False
             self.parent = parent
+            # Position in Graph.edges, set by connect
+            self.seq = None
+
+            # Replay data, the parent chain never changes so the depths
+            # are computed once here (see depth, dom_depth and
+            # rec_find_path in Functions.py). The path itself is not
+            # stored, it is the last path_len edges of the parent chain.
+            method = getattr(value, "method", None)
+            if parent:
+                self.depth = parent.depth + 1
+            else:
+                self.depth = 1
+            if parent and method == "event":
+                self.dom_depth = parent.dom_depth + 1
+            else:
+                self.dom_depth = 1
+            if parent and method != "get":
+                self.path_len = parent.path_len + 1
+            else:
+                self.path_len = 1
 
         def __eq__(self, other):
             return self.n1 == other.n1 and self.n2 == other.n2 and self.value == other.value
 
         def __hash__(self):
-            return hash(hash(self.n1) + hash(self.n2) + hash(self.value))
+            if self._hash is None:
+                self._hash = hash(hash(self.n1) + hash(self.n2) + hash(self.value))
+            return self._hash
 
         def __repr__(self):
             return str(self.n1) + " -(" + str(self.value) + "[" + str(self.visited) + "])-> " + str(self.n2)
 
     def add(self, value):
-        node = self.Node(value)
-        if not node in self.nodes:
-            self.nodes.append(node)
+        if not value in self.node_index:
+            self.index_node(self.Node(value))
             return True
         logging.info("failed to add node %s, already added" % str(value))
         return False
 
+    def index_node(self, node):
+        self.nodes.append(node)
+        self.node_index[node.value] = node
+        self.out_edges[node.value] = []
+        self.in_edges[node.value] = []
+
+    def index_edge(self, edge):
+        edge.seq = len(self.edges)
+        self.edges.append(edge)
+        self.edge_index[edge] = edge
+        self.out_edges[edge.n1.value].append(edge)
+        self.in_edges[edge.n2.value].append(edge)
+        if edge.parent is not None:
+            if not edge.parent in self.children:
+                self.children[edge.parent] = []
+            self.children[edge.parent].append(edge)
+        self.index_event(edge)
+        if not edge.visited:
+            self.frontier_push(edge)
+
+    # Only the lists and the meta data are pickled (checkpoints),
+    # the indexes and frontiers are rebuilt when loading.
+    def __getstate__(self):
+        return {'nodes': self.nodes,
+                'edges': self.edges,
+                'data': self.data,
+                'states': list(self.edge_states.items()),
+                'snapshots': list(self.snapshots.items())}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.data = state['data']
+        for node in state['nodes']:
+            self.index_node(node)
+        for edge in state['edges']:
+            self.index_edge(edge)
+        for (edge, dom_state) in state.get('states', []):
+            self.add_state(edge, dom_state)
+        self.snapshots = dict(state.get('snapshots', []))
+
+    def get_node(self, value):
+        return self.node_index.get(value)
+
+    # Returns the stored instance of an edge equal to the given one
+    def get_edge(self, edge):
+        return self.edge_index.get(edge)
+
     def create_edge(self, v1, v2, value, parent=None):
         n1 = self.Node(v1)
         n2 = self.Node(v2)
@@ -141,75 +313,373 @@ class Graph:
         return edge
 
     def connect(self, v1, v2, value, parent=None):
-        n1 = self.Node(v1)
-        n2 = self.Node(v2)
-        edge = self.Edge(n1, n2, value, parent)
-
-        p1 = n1 in self.nodes
-        p2 = n2 in self.nodes
-        p3 = not (edge in self.edges)
-        if (p1 and p2 and p3):
-            self.edges.append(edge)
-            return True
+        # Reuse the stored nodes so edges don't carry their own copies
+        n1 = self.node_index.get(v1)
+        n2 = self.node_index.get(v2)
+
+        p1 = n1 is not None
+        p2 = n2 is not None
+        if (p1 and p2):
+            edge = self.Edge(n1, n2, value, parent)
+            p3 = not (edge in self.edge_index)
+            if p3:
+                self.index_edge(edge)
+                return True
+        else:
+            p3 = None
         logging.warning("Failed to connect edge, %s (%s %s %s)" % (str(value), p1, p2, p3))
         return False
 
     def visit_node(self, value):
-        node = self.Node(value)
-        if node in self.nodes:
-            target = self.nodes[self.nodes.index(node)]
+        target = self.node_index.get(value)
+        if target is not None:
             target.visited = True
             return True
         return False
 
     def visit_edge(self, edge):
-        if (edge in self.edges):
-            target = self.edges[self.edges.index(edge)]
+        target = self.edge_index.get(edge)
+        if target is not None:
             target.visited = True
+            self.frontier_remove(target)
             return True
         return False
 
     def unvisit_edge(self, edge):
-        if (edge in self.edges):
-            target = self.edges[self.edges.index(edge)]
-            target.visited = False
+        target = self.edge_index.get(edge)
+        if target is not None:
+            if target.visited:
+                target.visited = False
+                self.frontier_push(target)
             return True
         return False
 
+    # Frontier kind of an edge, events are split into clicks and the rest.
+    # Deferred events have their own kind so they are only picked from
+    # the "all" fallback.
+    def frontier_kind(self, edge):
+        method = edge.value.method
+        if method == "event":
+            if edge in self.deferred_events:
+                return "deferred"
+            if "click" in edge.value.method_data.event:
+                return "click"
+            return "event"
+        return method
+
+    def frontier_push(self, edge):
+        kind = self.frontier_kind(edge)
+        if not kind in self.frontier:
+            self.frontier[kind] = Frontier()
+        if kind == "get":
+            self.frontier[kind].push(edge, self.link_key(edge))
+        else:
+            self.frontier[kind].push(edge)
+        if kind == "deferred":
+            # After every other edge
+            self.frontier["all"].push(edge, (1,))
+        else:
+            self.frontier["all"].push(edge)
+
+    # Events with the same handler function, event type, tag and class on
+    # the same page, e.g. the rows of a list that share one onclick. None
+    # for events without a handler (inputs, data-toggle, .btn).
+    def event_class(self, edge):
+        if edge.value.method != "event":
+            return None
+        event = edge.value.method_data
+        if not event.handler_id:
+            return None
+        return (edge.n1.value.url, event.handler_id, event.event, event.tag, event.event_class)
+
+    # Only the first representatives of an event class are crawled like
+    # other events, the rest are deferred until the class is promoted.
+    def index_event(self, edge):
+        event_class = self.event_class(edge)
+        if event_class is None:
+            return
+        if not event_class in self.event_classes:
+            self.event_classes[event_class] = []
+        members = self.event_classes[event_class]
+        members.append(edge)
+        if (len(members) > self.data.get('event_representatives', 3) and
+                not self.event_class_promoted(event_class)):
+            self.deferred_events.add(edge)
+
+    # data['event_states'] counts the new DOM states reached by the events
+    # of a class. The first one is expected, any more means the elements
+    # do different things and the whole class is crawled.
+    def event_class_promoted(self, event_class):
+        return self.data.get('event_states', {}).get(event_class, 0) > 1
+
+    # Called when an event edge reached a new DOM state
+    def event_new_state(self, edge):
+        event_class = self.event_class(edge)
+        if event_class is None:
+            return
+        if not 'event_states' in self.data:
+            self.data['event_states'] = {}
+        event_states = self.data['event_states']
+        event_states[event_class] = event_states.get(event_class, 0) + 1
+        if not self.event_class_promoted(event_class):
+            return
+        for member in self.event_classes.get(event_class, []):
+            if member in self.deferred_events:
+                if not member.visited:
+                    self.frontier_remove(member)
+                self.deferred_events.discard(member)
+                if not member.visited:
+                    self.frontier_push(member)
+
+    # Url features and template of a GET edge, computed once and indexed
+    # by path and template. Returns (path, depth, queries).
+    def index_link(self, edge):
+        if not edge in self.link_index:
+            url = edge.n2.value.url
+            (path, depth, queries) = link_features(url)
+            features = (intern_str(path), depth, queries)
+            self.link_index[edge] = features
+            if not path in self.link_paths:
+                self.link_paths[path] = []
+            self.link_paths[path].append(edge)
+
+            template = intern_str(url_template(url))
+            self.link_templates[edge] = template
+            if not template in self.template_edges:
+                self.template_edges[template] = []
+            self.template_edges[template].append(edge)
+        return self.link_index[edge]
+
+    def link_template(self, edge):
+        self.index_link(edge)
+        return self.link_templates[edge]
+
+    # Diminishing returns for a template, grows with log2 of its visits
+    def template_rank(self, template):
+        return self.data.get('templates', {}).get(template, 0).bit_length()
+
+    # (visited, depth, queries) from link_features, with urls from
+    # templates that have been visited a lot pushed back after the
+    # visited flag
+    def link_key(self, edge):
+        (path, depth, queries) = self.index_link(edge)
+        visited = 0
+        if path in self.data.get('urls', {}):
+            visited = 1
+        return (visited, self.template_rank(self.link_templates[edge]), depth, queries)
+
+    # Counts a visit to a path in data['urls'], returns the new count.
+    # The first visit changes the rank of all GETs to that path.
+    def visit_url(self, path):
+        urls = self.data['urls']
+        if not path in urls:
+            urls[path] = 0
+            for edge in self.link_paths.get(path, []):
+                if edge.value.method == "get":
+                    self.frontier["get"].update(edge, self.link_key(edge))
+        urls[path] += 1
+        return urls[path]
+
+    # Counts a visit to a url template in data['templates'], returns the
+    # new count. GETs of the template are re-ranked when its rank changes.
+    def visit_template(self, template):
+        if not 'templates' in self.data:
+            self.data['templates'] = {}
+        templates = self.data['templates']
+        rank = self.template_rank(template)
+        templates[template] = templates.get(template, 0) + 1
+        if self.template_rank(template) != rank:
+            for edge in self.template_edges.get(template, []):
+                if edge.value.method == "get":
+                    self.frontier["get"].update(edge, self.link_key(edge))
+        return templates[template]
+
+    # Records that edge led to dom_state and returns the first edge that
+    # reached that state. If that is not edge itself the state has been
+    # explored already.
+    def add_state(self, edge, dom_state):
+        self.edge_states[edge] = dom_state
+        if not dom_state in self.states:
+            self.states[dom_state] = edge
+        return self.states[dom_state]
+
+    # Forgets the state edge led to, e.g. when it could not be expanded,
+    # so the next edge that reaches it expands it instead
+    def remove_state(self, edge):
+        dom_state = self.edge_states.pop(edge, None)
+        if dom_state is not None and self.states.get(dom_state) is edge:
+            del self.states[dom_state]
+        self.snapshots.pop(edge, None)
+
+    # New states per event class are counted again too, otherwise states
+    # reached again after the reset would promote their classes
+    def reset_states(self):
+        self.states = {}
+        self.edge_states = {}
+        self.data['event_states'] = {}
+
+    def reset_url_visits(self):
+        self.data['urls'] = {}
+        self.data['templates'] = {}
+        for edge in self.unvisited_edges("get"):
+            self.frontier["get"].update(edge, self.link_key(edge))
+
+    def frontier_remove(self, edge):
+        self.frontier[self.frontier_kind(edge)].remove(edge)
+        self.frontier["all"].remove(edge)
+
+    # Number of unvisited edges of a frontier kind
+    def unvisited_count(self, kind="all"):
+        if kind in self.frontier:
+            return len(self.frontier[kind])
+        return 0
+
+    # First unvisited edge of a frontier kind, None if there are none
+    def next_unvisited(self, kind="all"):
+        if kind in self.frontier:
+            return self.frontier[kind].peek()
+        return None
+
+    # All unvisited edges of a frontier kind, in frontier order
+    def unvisited_edges(self, kind="all"):
+        if kind in self.frontier:
+            return self.frontier[kind].edges()
+        return []
+
     def get_parents(self, value):
-        node = self.Node(value)
-        return [edge.n1.value for edge in self.edges if node == edge.n2]
+        return [edge.n1.value for edge in self.in_edges.get(value, [])]
+
+    # Edges leading to / from a node value
+    def edges_to(self, value):
+        return self.in_edges.get(value, [])
+
+    def edges_from(self, value):
+        return self.out_edges.get(value, [])
 
     def __repr__(self):
-        res = "---GRAPH---\n"
+        res = ["---GRAPH---\n"]
         for n in self.nodes:
-            res += str(n) + " "
-        res += "\n"
+            res.append(str(n) + " ")
+        res.append("\n")
         for edge in self.edges:
-            res += str(edge.n1) + " -(" + str(edge.value) + "[" + str(edge.visited) + "])-> " + str(edge.n2) + "\n"
-        res += "\n---/GRAPH---"
-        return res
-
-    # Generates strings that can be pasted into mathematica to draw a graph.
-    def toMathematica(self):
-        cons = [('"' + str(edge.n1) + '" -> "' + str(edge.n2) + '"') for edge in self.edges]
-        data = "{" + ",".join(cons) + "}"
-
-        edge_cons = [('("' + str(edge.n1) + '" -> "' + str(edge.n2) + '") -> "' + edge.value.method + "," + str(
-            edge.value.method_data) + '"') for edge in self.edges]
-        edge_data = "{" + ",".join(edge_cons) + "}"
+            res.append(str(edge.n1) + " -(" + str(edge.value) + "[" + str(edge.visited) + "])-> " + str(edge.n2) + "\n")
+        res.append("\n---/GRAPH---")
+        return "".join(res)
+
+    # Writes the graph as JSON Lines, one record per node and edge.
+    # Records are written one by one so memory use doesn't depend on the
+    # size of the graph. Read it back with Utils.read_graph_jsonl.
+    #   {"type": "node", "id", "url", "method", "visited"}
+    #   {"type": "edge", "id", "from", "to", "method", "data", "visited", "parent"}
+    # "from"/"to" are node ids and "parent" is the id of the parent edge.
+    def export_jsonl(self, f):
+        node_ids = {}
+        for node in self.nodes:
+            node_ids[node.value] = len(node_ids)
+            f.write(json.dumps({"type": "node",
+                                "id": node_ids[node.value],
+                                "url": node.value.url,
+                                "method": node.value.method,
+                                "visited": node.visited}) + "\n")
+        for edge in self.edges:
+            parent = None
+            if edge.parent:
+                parent = edge.parent.seq
+            f.write(json.dumps({"type": "edge",
+                                "id": edge.seq,
+                                "from": node_ids[edge.n1.value],
+                                "to": node_ids[edge.n2.value],
+                                "method": edge.value.method,
+                                "data": str(edge.value.method_data),
+                                "visited": edge.visited,
+                                "parent": parent}) + "\n")
+
+
+# Priority queue of unvisited edges. Entries are ordered by (key, seq),
+# so with the default key the edges come out in insertion order.
+# Removed entries are invalidated in place and skipped lazily.
+class Frontier:
+    def __init__(self):
+        self.heap = []
+        # edge -> (key, seq, edge), the live heap entry for the edge.
+        # Entries that are no longer in here are stale and skipped on peek.
+        self.entries = {}
+
+    def push(self, edge, key=()):
+        entry = (key, edge.seq, edge)
+        self.entries[edge] = entry
+        heapq.heappush(self.heap, entry)
+
+    # Changes the key of an edge that is still queued
+    def update(self, edge, key):
+        if edge in self.entries:
+            self.push(edge, key)
+
+    def remove(self, edge):
+        self.entries.pop(edge, None)
+
+    def peek(self):
+        while self.heap:
+            entry = self.heap[0]
+            edge = entry[-1]
+            if self.entries.get(edge) is not entry:
+                heapq.heappop(self.heap)
+            elif edge.visited:
+                # Visited without going through the graph
+                self.remove(edge)
+            else:
+                return edge
+        return None
 
-        vertex_labels = 'VertexLabels -> All'
-        edge_labels = 'EdgeLabels -> ' + edge_data
-        arrow_size = 'EdgeShapeFunction -> GraphElementData["FilledArrow", "ArrowSize" -> 0.005]'
-        vertex_size = 'VertexSize -> 0.1'
-        image_size = 'ImageSize->Scaled[3]'
+    def edges(self):
+        return [entry[-1] for entry in sorted(self.entries.values())]
 
-        settings = [vertex_labels, edge_labels, arrow_size, vertex_size, image_size]
+    def __len__(self):
+        return len(self.entries)
 
-        res = "Graph[" + data + ", " + ','.join(settings) + "  ]"
 
-        return res
+# Deduplicated storage of the cookie jars seen during the crawl.
+# Every distinct cookie is kept once, keyed by its content, and every
+# distinct jar (set of cookies) gets a small integer id. Edges only keep
+# that id instead of their own copy of driver.get_cookies().
+class CookieStore:
+    def __init__(self):
+        # cookie id -> cookie dict
+        self.cookies = []
+        # cookie key -> cookie id
+        self.cookie_index = {}
+        # state id -> sorted tuple of cookie ids
+        self.states = []
+        # tuple of cookie ids -> state id
+        self.state_index = {}
+
+    # Content key of a single cookie, independent of the dict order
+    def cookie_key(self, cookie):
+        return tuple(sorted((intern_str(k), v) for (k, v) in cookie.items()))
+
+    # Stores a jar as returned by driver.get_cookies(), returns its id
+    def add(self, cookies):
+        ids = []
+        for cookie in cookies:
+            key = self.cookie_key(cookie)
+            if not key in self.cookie_index:
+                self.cookie_index[key] = len(self.cookies)
+                self.cookies.append(dict(key))
+            ids.append(self.cookie_index[key])
+        state = tuple(sorted(ids))
+        if not state in self.state_index:
+            self.state_index[state] = len(self.states)
+            self.states.append(state)
+        return self.state_index[state]
+
+    # Copy of the jar with the given id, in the driver.get_cookies() format
+    def get(self, state_id):
+        if state_id is None:
+            return []
+        return [dict(self.cookies[cookie_id]) for cookie_id in self.states[state_id]]
+
+    def __len__(self):
+        return len(self.states)
 
 
 class Form:
@@ -227,11 +697,17 @@ class Form:
                 return True
         return False
 
-    class Element:
+    class Element(Slotted):
+        # use is set for <input type="image"> by set_standard_values
+        __slots__ = ("itype", "name", "value", "use", "_hash")
+        _hash_fields = ("itype", "name")
+
         def __init__(self, itype, name, value):
-            self.itype = itype
-            self.name = name
+            self.itype = intern_str(itype)
+            self.name = intern_str(name)
             self.value = value
+            self.use = None
+            self._hash = None
 
         def __repr__(self):
             return str((self.itype, self.name, self.value))
@@ -240,12 +716,18 @@ class Form:
             return (self.itype == other.itype) and (self.name == other.name)
 
         def __hash__(self):
-            return hash(hash(self.itype) + hash(self.name))
+            if self._hash is None:
+                self._hash = hash(hash(self.itype) + hash(self.name))
+            return self._hash
+
+    class SubmitElement(Slotted):
+        __slots__ = ("itype", "name", "value", "use", "_hash")
+        _hash_fields = ("itype", "name", "use")
 
-    class SubmitElement:
         def __init__(self, itype, name, value, use):
-            self.itype = itype
-            self.name = name
+            self._hash = None
+            self.itype = intern_str(itype)
+            self.name = intern_str(name)
             self.value = value
             # If many submit button are available, one must be picked.
             self.use = use
@@ -259,12 +741,18 @@ class Form:
                     (self.use == other.use))
 
         def __hash__(self):
-            return hash(hash(self.itype) + hash(self.name) + hash(self.use))
+            if self._hash is None:
+                self._hash = hash(hash(self.itype) + hash(self.name) + hash(self.use))
+            return self._hash
+
+    class RadioElement(Slotted):
+        __slots__ = ("itype", "name", "value", "click", "override_value", "_hash")
+        _hash_fields = ("itype", "name", "value")
 
-    class RadioElement:
         def __init__(self, itype, name, value):
-            self.itype = itype
-            self.name = name
+            self._hash = None
+            self.itype = intern_str(itype)
+            self.name = intern_str(name)
             self.value = value
             # Click is used when filling out the form
             self.click = False
@@ -281,12 +769,18 @@ class Form:
             return (p1 and p2 and p3)
 
         def __hash__(self):
-            return hash(hash(self.itype) + hash(self.name) + hash(self.value))
+            if self._hash is None:
+                self._hash = hash(hash(self.itype) + hash(self.name) + hash(self.value))
+            return self._hash
+
+    class SelectElement(Slotted):
+        __slots__ = ("itype", "name", "options", "selected", "override_value", "_hash")
+        _hash_fields = ("itype", "name")
 
-    class SelectElement:
         def __init__(self, itype, name):
-            self.itype = itype
-            self.name = name
+            self._hash = None
+            self.itype = intern_str(itype)
+            self.name = intern_str(name)
             self.options = []
             self.selected = None
             self.override_value = ""
@@ -301,12 +795,18 @@ class Form:
             return (self.itype == other.itype) and (self.name == other.name)
 
         def __hash__(self):
-            return hash(hash(self.itype) + hash(self.name))
+            if self._hash is None:
+                self._hash = hash(hash(self.itype) + hash(self.name))
+            return self._hash
+
+    class CheckboxElement(Slotted):
+        __slots__ = ("itype", "name", "value", "checked", "override_value", "_hash")
+        _hash_fields = ("itype", "name", "checked")
 
-    class CheckboxElement:
         def __init__(self, itype, name, value, checked):
-            self.itype = itype
-            self.name = name
+            self._hash = None
+            self.itype = intern_str(itype)
+            self.name = intern_str(name)
             self.value = value
             self.checked = checked
             self.override_value = ""
@@ -318,7 +818,9 @@ class Form:
             return (self.itype == other.itype) and (self.name == other.name) and (self.checked == other.checked)
 
         def __hash__(self):
-            return hash(hash(self.itype) + hash(self.name) + hash(self.checked))
+            if self._hash is None:
+                self._hash = hash(hash(self.itype) + hash(self.name) + hash(self.checked))
+            return self._hash
 
     # <select>
     def add_select(self, itype, name):
@@ -391,14 +893,22 @@ class Form:
 
 
 # JavaScript events, clicks, onmouse etc.
-class Event:
-    def __init__(self, fid, event, i, tag, addr, c):
-        self.function_id = fid
-        self.event = event
-        self.id = i
-        self.tag = tag
-        self.addr = addr
-        self.event_class = c
+class Event(Slotted):
+    __slots__ = ("function_id", "event", "id", "tag", "addr", "event_class",
+                 "handler_id", "_hash")
+    _hash_fields = ("function_id", "id", "tag", "addr")
+
+    # handler_id identifies the handler function without the element it is
+    # set on, it is not part of equality (see Graph.event_class)
+    def __init__(self, fid, event, i, tag, addr, c, handler_id=""):
+        self._hash = None
+        self.handler_id = intern_str(handler_id)
+        self.function_id = intern_str(fid)
+        self.event = intern_str(event)
+        self.id = intern_str(i)
+        self.tag = intern_str(tag)
+        self.addr = intern_str(addr)
+        self.event_class = intern_str(c)
 
     def __repr__(self):
         s = "Event(" + str(self.event) + ", " + self.addr + ")"
@@ -411,14 +921,16 @@ class Event:
                 self.addr == other.addr)
 
     def __hash__(self):
-        if self.tag == {}:
-            logging.warning("Strange tag... %s " % str(self.tag))
-            self.tag = ""
+        if self._hash is None:
+            if self.tag == {}:
+                logging.warning("Strange tag... %s " % str(self.tag))
+                self.tag = ""
 
-        return hash(hash(self.function_id) +
-                    hash(self.id) +
-                    hash(self.tag) +
-                    hash(self.addr))
+            self._hash = hash(hash(self.function_id) +
+                              hash(self.id) +
+                              hash(self.tag) +
+                              hash(self.addr))
+        return self._hash
 
 
 class Iframe:
@@ -484,8 +996,8 @@ class Crawler:
         self.io_graph = {}
 
         # Optimization to do multiple events in a row without
-        # page reloads.
-        self.events_in_row = 0
+        # page reloads. The count is kept per worker and tab
+        # (self.local.events_in_row), see follow_children
         self.max_events_in_row = 15
 
         # Start with gets
@@ -500,55 +1012,132 @@ class Crawler:
         self.done_form = {}
         self.max_done_form = 5
 
+        # Every cookie jar seen, edges refer to them by id
+        self.cookie_store = CookieStore()
+
+        # Extraction results per page state, least recently used first
+        # (url, dom fingerprint) -> dict with the extracted vectors
+        self.extraction_cache = OrderedDict()
+        self.max_extraction_cache = 500
+        # Inline event handlers per document, updated incrementally
+        self.property_tracker = PropertyTracker()
+
+        # Visits per url template (see url_template) before its GETs are discarded
+        self.template_budget = 50
+
+        # Events crawled per event class (see Graph.event_class) before
+        # the rest of the class is deferred
+        self.event_representatives = 3
+
+        # Snapshots of the crawl state, written at most once per interval
+        self.checkpoint_path = f"output/{self.url_domain}-{self.browser}-checkpoint.pkl"
+        self.checkpoint_interval = 300  # seconds
+        self.last_checkpoint = time.time()
+
+        # Extra browser sessions for parallel crawling (--workers), each
+        # one is driven by its own thread, see crawl_workers
+        self.worker_drivers = []
+        # Guards the graph and the rest of the shared crawl state
+        self.lock = threading.RLock()
+        # Per worker state: driver, property_tracker, prev_edge and events_in_row
+        self.local = threading.local()
+        self.idle_workers = set()
+        self.stopped = False
+        # Workers that failed max_worker_failures pages in a row, their
+        # driver is most likely dead
+        self.retired_workers = set()
+        self.max_worker_failures = 5
+        # Workers in the middle of a page, the RESET after the early gets
+        # waits until it is the only one (see wait_for_workers)
+        self.crawling_workers = 0
+        self.reset_pending = False
+        self.workers_changed = threading.Condition(self.lock)
+
+        # Window handles of the tabs to crawl in (--tabs), see crawl_tabs
+        self.tabs = []
+        # Seconds to wait for a page in a tab before extracting it anyway
+        self.tab_load_timeout = 10
+
+        # A page is extracted once it had no requests in flight and no DOM
+        # changes for settle_quiet seconds, or after settle_timeout seconds
+        self.settle_quiet = 0.3
+        self.settle_timeout = 3.0
+
+        # Timers due in the next timer_horizon seconds are run before a page
+        # is extracted, at most max_timer_calls callbacks per page
+        self.timer_horizon = 30.0
+        self.max_timer_calls = 1000
+
+        # Characters of local and session storage kept per state snapshot
+        self.max_snapshot_storage = 256 * 1024
+        # False while crawling in tabs, GETs don't wait for the page to load
+        self.wait_for_get = True
+
         logging.info("Init crawl on " + url)
 
-    def start(self, debug_mode=False, crawler_mode=False):
+    def start(self, debug_mode=False, crawler_mode=False, resume=False):
 
         if (crawler_mode == False):
             print("run both crawler module and attack module")
         else:
             print("only run the crawler module")
 
-        self.root_req = Request("ROOTREQ", "get")
-        req = Request(self.url, "get")
-        self.graph.add(self.root_req)
-        self.graph.add(req)
-        self.graph.connect(self.root_req, req, CrawlEdge("get", None, None))
         self.debug_mode = debug_mode
 
-        # Path deconstruction
-        # TODO arg for this
-        if not debug_mode:
-            purl = urlparse(self.url)
-            if purl.path:
-                path_builder = ""
-                for d in purl.path.split("/")[:-1]:
-                    if d:
-                        path_builder += d + "/"
-                        tmp_purl = purl._replace(path=path_builder)
-                        req = Request(tmp_purl.geturl(), "get")
-                        self.graph.add(req)
-                        self.graph.connect(self.root_req, req, CrawlEdge("get", None, None))
-
-        self.graph.data['urls'] = {}
-        self.graph.data['form_urls'] = {}
+        if resume and self.load_checkpoint():
+            print("Resuming crawl from " + self.checkpoint_path)
+        else:
+            self.root_req = Request("ROOTREQ", "get")
+            req = Request(self.url, "get")
+            self.graph.add(self.root_req)
+            self.graph.add(req)
+            self.graph.connect(self.root_req, req, CrawlEdge("get", None, None))
+
+            # Path deconstruction
+            # TODO arg for this
+            if not debug_mode:
+                purl = urlparse(self.url)
+                if purl.path:
+                    path_builder = ""
+                    for d in purl.path.split("/")[:-1]:
+                        if d:
+                            path_builder += d + "/"
+                            tmp_purl = purl._replace(path=path_builder)
+                            req = Request(tmp_purl.geturl(), "get")
+                            self.graph.add(req)
+                            self.graph.connect(self.root_req, req, CrawlEdge("get", None, None))
+
+            self.graph.data['urls'] = {}
+            self.graph.data['form_urls'] = {}
+
+            random.seed(6)  # chosen by fair dice roll
+
+        self.graph.data['template_budget'] = self.template_budget
+        self.graph.data['event_representatives'] = self.event_representatives
+
         open(f"output/{self.url_domain}-{self.browser}-run.flag", "w+").write("1")
         open(f"output/{self.url_domain}-{self.browser}-queue.txt", "w+").write("")
         open(f"output/{self.url_domain}-{self.browser}-command.txt", "w+").write("")
 
-        random.seed(6)  # chosen by fair dice roll
+        if self.worker_drivers or len(self.tabs) > 1:
+            if self.worker_drivers:
+                done = self.crawl_workers()
+            else:
+                done = self.crawl_tabs()
+            if done:
+                self.finish()
+            self.checkpoint()
+            print("Done crawling")
+            return
 
         still_work = True
         i = -1
         while still_work:
             i += 1
             print("-" * 50)
-            new_edges = len([edge for edge in self.graph.edges if edge.visited == False])
+            new_edges = self.graph.unvisited_count()
             print("Edges left: %s" % str(new_edges))
             try:
-                # f = open("graph.txt", "w")
-                # f.write( self.graph.toMathematica() )
-
                 if "0" in open(f"output/{self.url_domain}-{self.browser}-run.flag", "r").read():
                     logging.info("Run set to 0, stop crawling")
                     break
@@ -557,17 +1146,9 @@ class Crawler:
                     input("Crawler paused, press enter to continue")
                     open(f"output/{self.url_domain}-{self.browser}-run.flag", "w+").write("3")
 
-                n_gets = 0
-                n_forms = 0
-                n_events = 0
-                for edge in self.graph.edges:
-                    if edge.visited == False:
-                        if edge.value.method == "get":
-                            n_gets += 1
-                        elif edge.value.method == "form":
-                            n_forms += 1
-                        elif edge.value.method == "event":
-                            n_events += 1
+                n_gets = self.graph.unvisited_count("get")
+                n_forms = self.graph.unvisited_count("form")
+                n_events = self.graph.unvisited_count("click") + self.graph.unvisited_count("event")
                 print()
                 print("----------------------")
                 print("GETS    | FROMS  | EVENTS ")
@@ -585,11 +1166,274 @@ class Crawler:
                     logging.error("Top level error while crawling")
                 # input("Enter to continue")
 
+                self.maybe_checkpoint()
+
             except KeyboardInterrupt:
                 print("CTRL-C, abort mission")
                 break
 
+        if not still_work:
+            self.finish()
+        self.checkpoint()
+        print("Done crawling")
+
+    # Crawls with one thread per driver in [self.driver] + worker_drivers.
+    # The workers share the graph, every edge is claimed by one of them
+    # when it is taken from the frontier. Returns True if the crawl is
+    # done, False if it was stopped.
+    def crawl_workers(self):
+        drivers = [self.driver] + self.worker_drivers
+        threads = []
+        for (number, driver) in enumerate(drivers):
+            thread = threading.Thread(target=self.worker_loop, args=(number, driver),
+                                      name="worker-%d" % number, daemon=True)
+            thread.start()
+            threads.append(thread)
+        print("Crawling with %d workers" % len(threads))
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+                if "0" in open(f"output/{self.url_domain}-{self.browser}-run.flag", "r").read():
+                    logging.info("Run set to 0, stop crawling")
+                    self.stopped = True
+                with self.lock:
+                    self.maybe_checkpoint()
+        except KeyboardInterrupt:
+            print("CTRL-C, abort mission")
+            self.stopped = True
+
+        for thread in threads:
+            thread.join()
+        if len(self.retired_workers) == len(drivers):
+            print("All workers failed, stopping")
+            return False
+        return len(self.idle_workers) + len(self.retired_workers) == len(drivers)
+
+    # A worker stops when it finds nothing to crawl while all the other
+    # workers are idle too, otherwise they may still add edges. A worker
+    # that keeps failing is retired and no longer counted.
+    def worker_loop(self, number, driver):
+        self.local.driver = driver
+        self.local.property_tracker = PropertyTracker()
+        workers = 1 + len(self.worker_drivers)
+        failures = 0
+        while not self.stopped:
+            with self.lock:
+                self.idle_workers.discard(number)
+                # Let a RESET run before taking the next edge
+                while self.reset_pending and not self.stopped:
+                    self.workers_changed.wait(1)
+                self.crawling_workers += 1
+            try:
+                still_work = self.rec_crawl()
+                failures = 0
+            except Exception as e:
+                still_work = True
+                failures += 1
+                print(e)
+                print(traceback.format_exc())
+                logging.error(e)
+                logging.error("Top level error in worker %d (%d in a row)" % (number, failures))
+            finally:
+                with self.lock:
+                    self.crawling_workers -= 1
+                    self.workers_changed.notify_all()
+
+            if failures >= self.max_worker_failures:
+                print("Worker %d failed %d times in a row, retiring it" % (number, failures))
+                logging.error("Retiring worker %d" % number)
+                with self.lock:
+                    self.retired_workers.add(number)
+                    self.workers_changed.notify_all()
+                break
+            if failures:
+                time.sleep(failures)
+                continue
+            if still_work:
+                continue
+
+            with self.lock:
+                self.idle_workers.add(number)
+                if len(self.idle_workers) + len(self.retired_workers) == workers:
+                    break
+            time.sleep(1)
+
+    # Waits (holding self.lock) until the calling worker is the only one
+    # in the middle of a page. New pages are not started meanwhile.
+    def wait_for_workers(self):
+        self.reset_pending = True
+        try:
+            while self.crawling_workers > 1 and not self.stopped:
+                self.workers_changed.wait(1)
+        finally:
+            self.reset_pending = False
+            self.workers_changed.notify_all()
+
+    # Crawls in several tabs of one browser. A tab that is waiting for its
+    # page to load (or to settle) is skipped and the next tab is
+    # crawled in the meantime. Returns True if the crawl is done, False
+    # if it was stopped.
+    def crawl_tabs(self):
+        driver = self.driver
+        graph = self.graph
+        self.wait_for_get = False
+        tabs = [{'handle': handle, 'todo': None, 'since': 0, 'prev': None, 'events_in_row': 0}
+                for handle in self.tabs]
+        print("Crawling in %d tabs" % len(tabs))
+
+        try:
+            while True:
+                if "0" in open(f"output/{self.url_domain}-{self.browser}-run.flag", "r").read():
+                    logging.info("Run set to 0, stop crawling")
+                    return False
+
+                busy = False
+                progress = False
+                for tab in tabs:
+                    driver.switch_to.window(tab['handle'])
+                    if tab['todo']:
+                        try:
+                            loaded = page_loaded(driver, self.settle_quiet)
+                        except UnexpectedAlertPresentException:
+                            remove_alerts(driver)
+                            loaded = False
+                        except Exception as e:
+                            logging.warning("Could not check if the page loaded: " + str(e))
+                            loaded = True
+                        if not loaded and time.time() - tab['since'] < self.tab_load_timeout:
+                            busy = True
+                            continue
+
+                        (edge, request) = tab['todo']
+                        tab['todo'] = None
+                        # Unknown until the page is processed
+                        tab['prev'] = None
+                        progress = True
+                        try:
+                            self.process_page(driver, graph, edge, request)
+                            tab['prev'] = edge
+                        except Exception as e:
+                            print(e)
+                            print(traceback.format_exc())
+                            logging.error(e)
+                            logging.error("Top level error in tab " + str(tab['handle']))
+
+                    # The state this tab is in, see follow_children
+                    self.local.prev_edge = tab['prev']
+                    self.local.events_in_row = tab['events_in_row']
+                    try:
+                        tab['todo'] = self.load_page(driver, graph)
+                    except Exception as e:
+                        print(e)
+                        print(traceback.format_exc())
+                        logging.error(e)
+                        logging.error("Top level error in tab " + str(tab['handle']))
+                        busy = True
+                    tab['events_in_row'] = self.local.events_in_row
+                    if tab['todo']:
+                        tab['since'] = time.time()
+                        busy = True
+                        progress = True
+
+                if not busy:
+                    return True
+                if not progress:
+                    # Every tab is still loading
+                    time.sleep(0.05)
+                self.maybe_checkpoint()
+        except KeyboardInterrupt:
+            print("CTRL-C, abort mission")
+            return False
+        finally:
+            self.wait_for_get = True
+
+    # Driver of the current worker thread
+    def worker_driver(self):
+        return getattr(self.local, "driver", self.driver)
+
+    def finish(self):
+        graph = self.graph
         print("Done crawling")
+        print("Graph: %d nodes, %d edges" % (len(graph.nodes), len(graph.edges)))
+        print("States restored from snapshots: %d (%d failed)" % (graph.data.get('snapshot_restores', 0),
+                                                                  graph.data.get('snapshot_failures', 0)))
+        print("Replays avoided by reusing the browser state: %d" % graph.data.get('replays_avoided', 0))
+        pprint.pprint(self.io_graph)
+
+        for tracker in self.io_graph:
+            if self.io_graph[tracker]['reflected']:
+                print("EDGE FROM ", self.io_graph[tracker]['injected'], "to", self.io_graph[tracker]['reflected'])
+
+        self.export_graph()
+
+    # Streams the graph to output/<domain>-<browser>-graph.jsonl
+    def export_graph(self):
+        graph_path = f"output/{self.url_domain}-{self.browser}-graph.jsonl"
+        with open(graph_path + ".tmp", "w") as f:
+            self.graph.export_jsonl(f)
+        os.replace(graph_path + ".tmp", graph_path)
+        logging.info("Graph written to " + graph_path)
+
+    def maybe_checkpoint(self):
+        if time.time() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    # Everything needed to continue the crawl. The graph goes first so
+    # that edges are pickled in insertion order (parents before children)
+    # and later references are only memo lookups.
+    def checkpoint_state(self):
+        return {'graph': self.graph,
+                'root_req': self.root_req,
+                'attack_lookup_table': self.attack_lookup_table,
+                'io_graph': self.io_graph,
+                'attacked_forms': self.attacked_forms,
+                'done_form': self.done_form,
+                'early_gets': self.early_gets,
+                'session_id': self.session_id,
+                'cookie_store': self.cookie_store,
+                'random_state': random.getstate()}
+
+    # Writes the snapshot to a temporary file and renames it, so a crash
+    # while writing never leaves a broken checkpoint behind.
+    def checkpoint(self):
+        start_time = time.time()
+        tmp_path = self.checkpoint_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.checkpoint_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.checkpoint_path)
+            logging.info("Checkpoint with %d edges written in %.2fs" % (len(self.graph.edges),
+                                                                        time.time() - start_time))
+        except Exception as e:
+            logging.error("Failed to write checkpoint: " + str(e))
+            logging.error(traceback.format_exc())
+        self.last_checkpoint = time.time()
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            print("No checkpoint found, starting a new crawl")
+            return False
+
+        with open(self.checkpoint_path, "rb") as f:
+            state = pickle.load(f)
+
+        self.graph = state['graph']
+        self.root_req = state['root_req']
+        self.attack_lookup_table = state['attack_lookup_table']
+        self.io_graph = state['io_graph']
+        self.attacked_forms = state['attacked_forms']
+        self.done_form = state['done_form']
+        self.early_gets = state['early_gets']
+        self.session_id = state['session_id']
+        self.cookie_store = state['cookie_store']
+        random.setstate(state['random_state'])
+
+        logging.info("Loaded checkpoint with %d edges, %d unvisited" % (len(self.graph.edges),
+                                                                       self.graph.unvisited_count()))
+        return True
 
     def extract_vectors(self):
         print("Extracting urls")
@@ -730,8 +1574,11 @@ class Crawler:
         logging.warning("Could not find lookup_id %s " % lookup_id)
         return None
 
-    def execute_path(self, driver, path):
+    # forms maps form edges to the Form to submit instead of their own
+    def execute_path(self, driver, path, forms=None):
         graph = self.graph
+        if forms is None:
+            forms = {}
 
         for edge_in_path in path:
             method = edge_in_path.value.method
@@ -744,7 +1591,7 @@ class Crawler:
                     logging.warning("Not allowed to get: " + str(edge_in_path.n2.value.url))
                     return False
             elif method == "form":
-                form = method_data
+                form = forms.get(edge_in_path, method_data)
                 try:
                     fill_result = form_fill(driver, form)
                     if not fill_result:
@@ -797,17 +1644,22 @@ class Crawler:
             if edge.value.method == "form":
                 form_edges.append(edge)
 
-        for form_edge in form_edges:
-            form = form_edge.value.method_data
-            tracker = self.get_tracker()
-            for parameter in form.inputs:
-                # List all injectable input types text, textarea, etc.
-                if parameter.itype == "text" or parameter.itype == "textarea":
-                    # Arm the payload
-                    form.inputs[parameter].value = tracker
-                    self.use_tracker(tracker, (form_edge, parameter, tracker))
-
-        self.execute_path(driver, path)
+        # The forms in the graph are shared with the other workers, the
+        # payloads go into copies that only this worker submits
+        armed_forms = {}
+        with self.lock:
+            for form_edge in form_edges:
+                form = copy.deepcopy(form_edge.value.method_data)
+                armed_forms[form_edge] = form
+                tracker = self.get_tracker()
+                for parameter in form.inputs:
+                    # List all injectable input types text, textarea, etc.
+                    if parameter.itype == "text" or parameter.itype == "textarea":
+                        # Arm the payload
+                        form.inputs[parameter].value = tracker
+                        self.use_tracker(tracker, (form_edge, parameter, tracker))
+
+        self.execute_path(driver, path, armed_forms)
 
         return successful_xss
 
@@ -815,58 +1667,151 @@ class Crawler:
 
     # Handle priority
     def next_unvisited_edge(self, driver, graph):
-        user_url = open(f"output/{self.url_domain}-{self.browser}-queue.txt", "r").read()
-        if user_url:
-            print("User supplied url: ", user_url)
-            logging.info("Adding user from URLs " + user_url)
-
-            req = Request(user_url, "get")
-            current_cookies = driver.get_cookies()
-            new_edge = graph.create_edge(self.root_req, req, CrawlEdge(req.method, None, current_cookies),
-                                         graph.data['prev_edge'])
-            graph.add(req)
-            graph.connect(self.root_req, req, CrawlEdge(req.method, None, current_cookies), graph.data['prev_edge'])
+        with self.lock:
+            user_url = open(f"output/{self.url_domain}-{self.browser}-queue.txt", "r").read()
+            if user_url:
+                print("User supplied url: ", user_url)
+                logging.info("Adding user from URLs " + user_url)
+
+                req = Request(user_url, "get")
+                cookie_id = self.cookie_store.add(driver.get_cookies())
+                new_edge = graph.create_edge(self.root_req, req, CrawlEdge(req.method, None, cookie_id),
+                                             graph.data['prev_edge'])
+                graph.add(req)
+                graph.connect(self.root_req, req, CrawlEdge(req.method, None, cookie_id), graph.data['prev_edge'])
 
-            print(new_edge)
+                print(new_edge)
 
-            open(f"output/{self.url_domain}-{self.browser}-queue.txt", "w+").write("")
-            open(f"output/{self.url_domain}-{self.browser}-run.flag", "w+").write("3")
+                open(f"output/{self.url_domain}-{self.browser}-queue.txt", "w+").write("")
+                open(f"output/{self.url_domain}-{self.browser}-run.flag", "w+").write("3")
 
+        if user_url:
             # input("Classes 1213 " + self.url)
-            successful = follow_edge(self.url, driver, graph, new_edge)
+            successful = follow_edge(self.url, driver, graph, new_edge, lock=self.lock)
             if successful:
                 return new_edge
             else:
                 logging.error("Could not load URL from user " + str(new_edge))
 
+        # Continue from the state the browser is in
+        edge = self.follow_children(driver, graph)
+        if edge:
+            return edge
+
+        with self.lock:
+            kind = self.next_kind(graph)
+        if kind == "attack":
+            prev_edge = self.prev_edge(graph)
+            print("prev was form, TRACK")
+            logging.info("prev was form, TRACK")
+            self.track_form(driver, prev_edge)
+            with self.lock:
+                kind = self.next_kind(graph, False)
+
+        edge = self.follow_frontier(driver, graph, kind)
+        if edge:
+            return edge
+
+        # Final fallback to any edge
+        edge = self.follow_frontier(driver, graph, "all")
+        if edge:
+            return edge
+
+        # Check if we are still in early explore mode
+        with self.lock:
+            early = self.early_gets < self.max_early_gets
+            if early:
+                # Turn off early search
+                self.early_gets = self.max_early_gets
+        if early:
+            return self.next_unvisited_edge(driver, graph)
+
+        return None
+
+    # Last edge loaded by the current worker
+    def prev_edge(self, graph):
+        return getattr(self.local, "prev_edge", graph.data.get('prev_edge'))
+
+    # Follows an unvisited edge found in the state of the previous edge.
+    # The browser is most likely still in that state, so find_state only
+    # has to execute the edge itself (see current_prefix). At most
+    # max_events_in_row in a row, then the frontier gets its turn again.
+    def follow_children(self, driver, graph):
+        prev_edge = self.prev_edge(graph)
+        early_state = not self.debug_mode and self.early_gets < self.max_early_gets
+        events_in_row = getattr(self.local, "events_in_row", 0)
+        if not prev_edge or early_state or events_in_row >= self.max_events_in_row:
+            self.local.events_in_row = 0
+            return None
+        # The form is attacked first, see next_kind
+        if prev_edge.value.method == "form" and not prev_edge.value.method_data in self.attacked_forms:
+            return None
+
+        # Edges found in the state are children of the first edge that reached it
+        state_edge = graph.states.get(graph.edge_states.get(prev_edge), prev_edge)
+        for child in list(graph.children.get(state_edge, [])):
+            with self.lock:
+                if (child.visited or child.value.method == "get" or
+                        child in graph.deferred_events):
+                    continue
+                graph.visit_edge(child)
+                allowed = check_edge(driver, graph, child)
+            if not allowed:
+                logging.warning("Check_edge failed for " + str(child))
+            elif follow_edge(self.url, driver, graph, child, self.wait_for_get, self.cookie_store,
+                             self.lock, (self.settle_quiet, self.settle_timeout)):
+                self.local.events_in_row = events_in_row + 1
+                return child
+
+        self.local.events_in_row = 0
+        return None
+
+    # True if the page in the browser is the one a GET of edge would load,
+    # checked against the state of the previous edge first to save a round trip
+    def at_page(self, driver, graph, edge):
+        prev_edge = self.prev_edge(graph)
+        prev_state = graph.edge_states.get(prev_edge)
+        if not prev_state or prev_state[0] != edge.n2.value.url:
+            return False
+        current = current_state(driver)
+        if current is None or current[0] != edge.n2.value.url:
+            return False
+        first_edge = graph.states.get(current)
+        return first_edge is not None and first_edge.value.method == "get"
+
+    # Frontier kind to crawl next, "attack" if the form of the previous
+    # edge should be tracked first (track_form, not done under the lock).
+    def next_kind(self, graph, attack=True):
         # Always handle the iframes
-        list_to_use = [edge for edge in graph.edges if edge.value.method == "iframe" and edge.visited == False]
-        if list_to_use:
+        kind = None
+        if graph.unvisited_count("iframe"):
             print("Following iframe edge")
+            kind = "iframe"
 
         # Start the crawl by focusing more on GETs
         if not self.debug_mode:
             if self.early_gets < self.max_early_gets:
                 print("Looking for EARLY gets")
                 print(self.early_gets, "/", self.max_early_gets)
-                list_to_use = [edge for edge in graph.edges if edge.value.method == "get" and edge.visited == False]
-                list_to_use = linkrank(list_to_use, graph.data['urls'])
-                # list_to_use = new_files(list_to_use, graph.data['urls'])
-                # list_to_use = reversed( list_to_use )
-                if list_to_use:
+                kind = None
+                if graph.unvisited_count("get"):
+                    kind = "get"
                     self.early_gets += 1
                 else:
                     print("No get, trying something else")
             if self.early_gets == self.max_early_gets:
+                # Other workers must not hold edges while they are unvisited
+                self.early_gets += 1
+                self.wait_for_workers()
                 print("RESET")
                 for edge in graph.edges:
                     graph.unvisit_edge(edge)
-                graph.data['urls'] = {}
+                graph.reset_url_visits()
+                graph.reset_states()
                 graph.data['form_urls'] = {}
-                self.early_gets += 1
 
-        if not list_to_use and 'prev_edge' in graph.data:
-            prev_edge = graph.data['prev_edge']
+        prev_edge = self.prev_edge(graph)
+        if not kind and attack and prev_edge:
 
             if prev_edge.value.method == "form":
 
@@ -879,72 +1824,56 @@ class Crawler:
                         self.attacked_forms[prev_form] = 0
                     self.attacked_forms[prev_form] += 1
 
-                    print("prev was form, TRACK")
-                    logging.info("prev was form, TRACK")
-                    self.track_form(driver, prev_edge)
+                    return "attack"
                 else:
                     logging.warning("Form already done! " + str(prev_form) + str(prev_form.inputs))
             else:
-                self.events_in_row = 0
+                self.local.events_in_row = 0
 
-        if not list_to_use:
+        if not kind:
             random_int = random.randint(0, 100)
-            if not list_to_use:
-                if random_int >= 0 and random_int < 50:
-                    print("Looking for form")
-                    list_to_use = [edge for edge in graph.edges if
-                                   edge.value.method == "form" and edge.visited == False]
-                elif random_int >= 50 and random_int < 80:
-                    print("Looking for get")
-                    list_to_use = [edge for edge in graph.edges if edge.value.method == "get" and edge.visited == False]
-                    list_to_use = linkrank(list_to_use, graph.data['urls'])
-                else:
-                    print("Looking for event")
-                    print("--Clicks")
-                    list_to_use = [edge for edge in graph.edges if edge.value.method == "event" and (
-                            "click" in edge.value.method_data.event) and edge.visited == False]
-                    if not list_to_use:
-                        print("--No clicks found, check all")
-                        list_to_use = [edge for edge in graph.edges if
-                                       edge.value.method == "event" and edge.visited == False]
+            if random_int >= 0 and random_int < 50:
+                print("Looking for form")
+                kind = "form"
+            elif random_int >= 50 and random_int < 80:
+                print("Looking for get")
+                kind = "get"
+            else:
+                print("Looking for event")
+                print("--Clicks")
+                kind = "click"
+                if not graph.unvisited_count(kind):
+                    print("--No clicks found, check all")
+                    kind = "event"
 
         # Try fallback to GET
-        if not list_to_use:
+        if not graph.unvisited_count(kind):
             logging.warning("Falling back to GET")
-            list_to_use = [edge for edge in graph.edges if edge.value.method == "get" and edge.visited == False]
-            list_to_use = linkrank(list_to_use, graph.data['urls'])
-
-        # for edge in graph.edges:
-        for edge in list_to_use:
-            if edge.visited == False:
-                if not check_edge(driver, graph, edge):
-                    logging.warning("Check_edge failed for " + str(edge))
-                    edge.visited = True
-                else:
-                    # input("Classes 1312 " + self.url)
-                    successful = follow_edge(self.url, driver, graph, edge)
-                    if successful:
-                        return edge
-
-        # Final fallback to any edge
-        for edge in graph.edges:
-            if edge.visited == False:
-                if not check_edge(driver, graph, edge):
-                    logging.warning("Check_edge failed for " + str(edge))
-                    edge.visited = True
-                else:
-                    # input("Classes 1324 " + self.url)
-                    successful = follow_edge(self.url, driver, graph, edge)
-                    if successful:
-                        return edge
-
-        # Check if we are still in early explore mode
-        if self.early_gets < self.max_early_gets:
-            # Turn off early search
-            self.early_gets = self.max_early_gets
-            return self.next_unvisited_edge(driver, graph)
-
-        return None
+            kind = "get"
+
+        return kind
+
+    # Follows the first edge of a frontier kind that passes check_edge.
+    # Every edge that is tried is marked visited when it is taken from the
+    # frontier, so no other worker takes it too.
+    def follow_frontier(self, driver, graph, kind):
+        while True:
+            with self.lock:
+                edge = graph.next_unvisited(kind)
+                if not edge:
+                    return None
+                graph.visit_edge(edge)
+                allowed = check_edge(driver, graph, edge)
+            if not allowed:
+                logging.warning("Check_edge failed for " + str(edge))
+            elif edge.value.method == "get" and self.at_page(driver, graph, edge):
+                logging.info("Already at %s, not loading it again" % edge.n2.value.url)
+                with self.lock:
+                    graph.data['replays_avoided'] = graph.data.get('replays_avoided', 0) + 1
+                return edge
+            elif follow_edge(self.url, driver, graph, edge, self.wait_for_get, self.cookie_store,
+                             self.lock, (self.settle_quiet, self.settle_timeout)):
+                return edge
 
     def load_page(self, driver, graph):
         request = None
@@ -954,6 +1883,7 @@ class Crawler:
 
         # Update last visited edge
         graph.data['prev_edge'] = edge
+        self.local.prev_edge = edge
 
         request = edge.n2.value
 
@@ -963,75 +1893,43 @@ class Crawler:
 
         return (edge, request)
 
-    # Actually not recursive (TODO change name)
-    def rec_crawl(self):
-        driver = self.driver
-        graph = self.graph
-
-        todo = self.load_page(driver, graph)
-        if not todo:
-            print("Done crawling")
-            print(graph)
-            pprint.pprint(self.io_graph)
-
-            for tracker in self.io_graph:
-                if self.io_graph[tracker]['reflected']:
-                    print("EDGE FROM ", self.io_graph[tracker]['injected'], "to", self.io_graph[tracker]['reflected'])
-
-            f = open(f"output/{self.url_domain}-{self.browser}-graph_mathematica.txt", "w")
-            f.write(self.graph.toMathematica())
-
-            return False
-
-        (edge, request) = todo
-        graph.visit_node(request)
-        graph.visit_edge(edge)
-
-        # (almost) Never GET twice (optimization)
-        if edge.value.method == "get":
-            for e in graph.edges:
-                if (edge.n2 == e.n2) and (edge != e) and (e.value.method == "get"):
-                    # print("Fake visit", e)
-                    graph.visit_edge(e)
-
-        # Wait if needed
-        try:
-            wait_json = driver.execute_script("return JSON.stringify(need_to_wait)")
-            wait = json.loads(wait_json)
-            if wait:
-                time.sleep(1)
-        except UnexpectedAlertPresentException:
-            logging.warning("Alert detected")
-            alert = driver.switch_to.alert
-            alert.dismiss()
-
-            # Check if double check is needed...
-            try:
-                wait_json = driver.execute_script("return JSON.stringify(need_to_wait)")
-                wait = json.loads(wait_json)
-                if wait:
-                    time.sleep(1)
-            except:
-                logging.warning("Inner wait error for need_to_wait")
-        except:
-            logging.warning("No need_to_wait")
-
-        # Timeouts
-        try:
-            resps = driver.execute_script("return JSON.stringify(timeouts)")
-            todo = json.loads(resps)
-            for t in todo:
-                try:
-                    if t['function_name']:
-                        driver.execute_script(t['function_name'] + "()")
-                except:
-                    logging.warning("Could not execute javascript function in timeout " + str(t))
-        except:
-            logging.warning("No timeouts from stringify")
-
+    # Urls, forms, ui_forms, events and iframes of the current page.
+    # Pages already seen in the same state (same url and DOM fingerprint)
+    # are served from the cache, so they are only extracted once.
+    # The results are shared, don't modify them.
+    def extract(self, driver):
+        key = tuple(driver.execute_script("return dom_state()"))
+        with self.lock:
+            if key in self.extraction_cache:
+                logging.info("Extraction cache hit for %s" % str(key))
+                self.extraction_cache.move_to_end(key)
+                return self.extraction_cache[key]
+
+        tracker = getattr(self.local, "property_tracker", self.property_tracker)
+        snapshot = extract_snapshot(driver, tracker)
+        extracted = {'reqs': extract_urls(driver, snapshot),
+                     'forms': extract_forms(self.url, driver, snapshot),
+                     'ui_forms': extract_ui_forms(driver, snapshot),
+                     'events': extract_events(driver, snapshot),
+                     'iframes': extract_iframes(driver, snapshot)}
+
+        # The page may have changed since dom_state(), the snapshot has
+        # its own fingerprint (the same one, without walking the document
+        # again, if it did not)
+        key = (snapshot['url'], snapshot['fingerprint'])
+        with self.lock:
+            self.extraction_cache[key] = extracted
+            self.extraction_cache.move_to_end(key)
+            while len(self.extraction_cache) > self.max_extraction_cache:
+                self.extraction_cache.popitem(last=False)
+        return extracted
+
+    # Extracts a page in a new state, logging in first if it has a login form
+    def extract_state(self, driver, graph, edge):
         early_state = self.early_gets < self.max_early_gets
         # input("Classes 1422 " + self.url)
-        login_form = find_login_form(self.url, driver, graph, early_state)
+        extracted = self.extract(driver)
+        login_form = find_login_form(self.url, driver, graph, early_state, extracted['forms'])
 
         if login_form:
             logging.info("Found login form")
@@ -1042,86 +1940,167 @@ class Crawler:
                 form_fill(driver, new_form)
             except:
                 logging.warning("Failed to login to potiential login form")
-
-        # Extract urls, forms, elements, iframe etc
-        reqs = extract_urls(driver)
-        forms = extract_forms(self.url, driver)
-        forms = set_form_values(forms)
-        ui_forms = extract_ui_forms(driver)
-        events = extract_events(driver)
-        iframes = extract_iframes(driver)
-
-        # Check if we need to wait for asynch
+            # The page has most likely changed
+            extracted = self.extract(driver)
+        return extracted
+
+    # Records the cookies and storage of the state edge led to, so that
+    # find_state can restore it instead of replaying the path to it.
+    # GETs are just loaded again and states inside iframes can not be
+    # reached by url.
+    def snapshot_state(self, driver, graph, edge, dom_state):
+        if edge.value.method == "get":
+            return
+        if any(e.value.method == "iframe" for e in rec_find_path(graph, edge)):
+            return
         try:
-            wait_json = driver.execute_script("return JSON.stringify(need_to_wait)")
-        except UnexpectedAlertPresentException:
-            logging.warning("Alert detected")
-            alert = driver.switch_to.alert
-            alert.dismiss()
-        wait_json = driver.execute_script("return JSON.stringify(need_to_wait)")
-        wait = json.loads(wait_json)
-        if wait:
-            time.sleep(1)
+            storage = driver.execute_script("return storage_snapshot()")
+            cookies = driver.get_cookies()
+        except Exception as e:
+            logging.warning("Could not snapshot state: " + str(e))
+            return
+        if len(storage) > self.max_snapshot_storage:
+            logging.info("Storage too large for a snapshot (%d)" % len(storage))
+            return
+        with self.lock:
+            cookie_id = self.cookie_store.add(cookies)
+            # Storage is often the same for many states
+            graph.snapshots[edge] = (dom_state, cookie_id, intern_str(storage))
 
-        # Add findings to the graph
-        current_cookies = driver.get_cookies()
+    # Actually not recursive (TODO change name)
+    # Returns False when there is nothing left to crawl, see finish
+    def rec_crawl(self):
+        driver = self.worker_driver()
+        graph = self.graph
 
-        logging.info("Adding requests from URLs")
-        for req in reqs:
-            logging.info("from URLs %s " % str(req))
-            new_edge = graph.create_edge(request, req, CrawlEdge(req.method, None, current_cookies), edge)
-            if allow_edge(graph, new_edge):
-                graph.add(req)
-                graph.connect(request, req, CrawlEdge(req.method, None, current_cookies), edge)
-            else:
-                logging.info("Not allowed to add edge: %s" % new_edge)
-
-        logging.info("Adding requests from froms")
-        for form in forms:
-            req = Request(form.action, form.method)
-            logging.info("from forms %s " % str(req))
-            new_edge = graph.create_edge(request, req, CrawlEdge("form", form, current_cookies), edge)
-            if allow_edge(graph, new_edge):
-                graph.add(req)
-                graph.connect(request, req, CrawlEdge("form", form, current_cookies), edge)
-            else:
-                logging.info("Not allowed to add edge: %s" % new_edge)
+        todo = self.load_page(driver, graph)
+        if not todo:
+            return False
 
-        logging.info("Adding requests from events")
-        for event in events:
-            req = Request(request.url, "event")
-            logging.info("from events %s " % str(req))
+        (edge, request) = todo
+        self.process_page(driver, graph, edge, request)
+        return True
 
-            new_edge = graph.create_edge(request, req, CrawlEdge("event", event, current_cookies), edge)
-            if allow_edge(graph, new_edge):
-                graph.add(req)
-                graph.connect(request, req, CrawlEdge("event", event, current_cookies), edge)
+    # Extracts the page that edge led to and adds the findings to the graph
+    def process_page(self, driver, graph, edge, request):
+        with self.lock:
+            graph.visit_node(request)
+            graph.visit_edge(edge)
+
+            # (almost) Never GET twice (optimization)
+            if edge.value.method == "get":
+                for e in graph.edges_to(request):
+                    if (edge != e) and (e.value.method == "get"):
+                        # print("Fake visit", e)
+                        graph.visit_edge(e)
+
+        # Timeouts and intervals, run in the page on a virtual clock
+        flush_timers(driver, self.timer_horizon, self.max_timer_calls)
+
+        # Wait for XHRs, fetches and DOM changes to finish
+        if not wait_for_settle(driver, self.settle_quiet, self.settle_timeout):
+            in_flight = requests_in_flight(driver)
+            if in_flight:
+                logging.info("Page did not settle in %.1fs, %d requests in flight (%d long running)" %
+                             (self.settle_timeout, in_flight[1], in_flight[1] - in_flight[0]))
             else:
-                logging.info("Not allowed to add edge: %s" % new_edge)
+                logging.info("Page did not settle in %.1fs" % self.settle_timeout)
+
+        # Pages in a DOM state that has been explored before are not
+        # expanded again, their vectors are already in the graph. Pages
+        # without our scripts (about:blank, PDFs) have no state and are
+        # always expanded.
+        dom_state = current_state(driver)
+        first_edge = edge
+        if dom_state is not None:
+            with self.lock:
+                first_edge = graph.add_state(edge, dom_state)
+                if first_edge is edge:
+                    graph.event_new_state(edge)
+            if first_edge is edge:
+                self.snapshot_state(driver, graph, edge, dom_state)
+        if first_edge is not edge:
+            logging.info("Known state, reached before by %s" % str(first_edge))
+            print("Known state, not expanding")
+            extracted = {'reqs': set(), 'forms': set(), 'ui_forms': [], 'events': set(), 'iframes': set()}
+        else:
+            try:
+                extracted = self.extract_state(driver, graph, edge)
+            except:
+                # Let the next edge into this state expand it
+                with self.lock:
+                    graph.remove_state(edge)
+                raise
 
-        logging.info("Adding requests from iframes")
-        for iframe in iframes:
-            req = Request(iframe.src, "iframe")
-            logging.info("from iframes %s " % str(req))
+        # Extract urls, forms, elements, iframe etc
+        reqs = extracted['reqs']
+        forms = set_form_values(extracted['forms'])
+        ui_forms = extracted['ui_forms']
+        events = extracted['events']
+        iframes = extracted['iframes']
 
-            new_edge = graph.create_edge(request, req, CrawlEdge("iframe", iframe, current_cookies), edge)
-            if allow_edge(graph, new_edge):
-                graph.add(req)
-                graph.connect(request, req, CrawlEdge("iframe", iframe, current_cookies), edge)
-            else:
-                logging.info("Not allowed to add edge: %s" % new_edge)
+        # Add findings to the graph
+        cookies = driver.get_cookies()
+        current_url = driver.current_url
+        with self.lock:
+            cookie_id = self.cookie_store.add(cookies)
+
+            logging.info("Adding requests from URLs")
+            for req in reqs:
+                logging.info("from URLs %s " % str(req))
+                new_edge = graph.create_edge(request, req, CrawlEdge(req.method, None, cookie_id), edge)
+                if allow_edge(graph, new_edge):
+                    graph.add(req)
+                    graph.connect(request, req, CrawlEdge(req.method, None, cookie_id), edge)
+                else:
+                    logging.info("Not allowed to add edge: %s" % new_edge)
+
+            logging.info("Adding requests from froms")
+            for form in forms:
+                req = Request(form.action, form.method)
+                logging.info("from forms %s " % str(req))
+                new_edge = graph.create_edge(request, req, CrawlEdge("form", form, cookie_id), edge)
+                if allow_edge(graph, new_edge):
+                    graph.add(req)
+                    graph.connect(request, req, CrawlEdge("form", form, cookie_id), edge)
+                else:
+                    logging.info("Not allowed to add edge: %s" % new_edge)
 
-        logging.info("Adding requests from ui_forms")
-        for ui_form in ui_forms:
-            req = Request(driver.current_url, "ui_form")
-            logging.info("from ui_forms %s " % str(req))
+            logging.info("Adding requests from events")
+            for event in events:
+                req = Request(request.url, "event")
+                logging.info("from events %s " % str(req))
 
-            new_edge = graph.create_edge(request, req, CrawlEdge("ui_form", ui_form, current_cookies), edge)
-            if allow_edge(graph, new_edge):
-                graph.add(req)
-                graph.connect(request, req, CrawlEdge("ui_form", ui_form, current_cookies), edge)
-            else:
-                logging.info("Not allowed to add edge: %s" % new_edge)
+                new_edge = graph.create_edge(request, req, CrawlEdge("event", event, cookie_id), edge)
+                if allow_edge(graph, new_edge):
+                    graph.add(req)
+                    graph.connect(request, req, CrawlEdge("event", event, cookie_id), edge)
+                else:
+                    logging.info("Not allowed to add edge: %s" % new_edge)
+
+            logging.info("Adding requests from iframes")
+            for iframe in iframes:
+                req = Request(iframe.src, "iframe")
+                logging.info("from iframes %s " % str(req))
+
+                new_edge = graph.create_edge(request, req, CrawlEdge("iframe", iframe, cookie_id), edge)
+                if allow_edge(graph, new_edge):
+                    graph.add(req)
+                    graph.connect(request, req, CrawlEdge("iframe", iframe, cookie_id), edge)
+                else:
+                    logging.info("Not allowed to add edge: %s" % new_edge)
+
+            logging.info("Adding requests from ui_forms")
+            for ui_form in ui_forms:
+                req = Request(current_url, "ui_form")
+                logging.info("from ui_forms %s " % str(req))
+
+                new_edge = graph.create_edge(request, req, CrawlEdge("ui_form", ui_form, cookie_id), edge)
+                if allow_edge(graph, new_edge):
+                    graph.add(req)
+                    graph.connect(request, req, CrawlEdge("ui_form", ui_form, cookie_id), edge)
+                else:
+                    logging.info("Not allowed to add edge: %s" % new_edge)
 
         # Try to clean up alerts
         try:
@@ -1130,40 +2109,43 @@ class Crawler:
         except NoAlertPresentException:
             pass
 
-        # Check for successful attacks
-        time.sleep(0.1)
-
-        if "3" in open(f"output/{self.url_domain}-{self.browser}-run.flag", "r").read():
+        # Stepping needs the console, only from the main thread (not with --workers)
+        if (threading.current_thread() is threading.main_thread() and
+                "3" in open(f"output/{self.url_domain}-{self.browser}-run.flag", "r").read()):
             logging.info("Run set to 3, pause each step")
             input("Crawler in stepping mode, press enter to continue. EDIT run.flag to run")
 
         # Check command
         found_command = False
         if "get_graph" in open(f"output/{self.url_domain}-{self.browser}-command.txt", "r").read():
-            f = open(f"output/{self.url_domain}-{self.browser}-graph.txt", "w+")
-            f.write(str(self.graph))
-            f.close()
+            with self.lock:
+                self.export_graph()
             found_command = True
         # Clear commad
         if found_command:
             open(f"output/{self.url_domain}-{self.browser}-command.txt", "w+").write("")
 
-        return True
-
 
 # Edge with specific crawling info, cookies, type of request etc.
-class CrawlEdge:
-    def __init__(self, method, method_data, cookies):
-        self.method = method
+class CrawlEdge(Slotted):
+    __slots__ = ("method", "method_data", "cookie_id", "_hash")
+    _hash_fields = ("method", "method_data")
+
+    # cookie_id is the id of the cookie jar in the crawler's CookieStore
+    def __init__(self, method, method_data, cookie_id):
+        self._hash = None
+        self.method = intern_str(method)
         self.method_data = method_data
-        self.cookies = cookies
+        self.cookie_id = cookie_id
 
     def __repr__(self):
         return str(self.method) + " " + str(self.method_data)
 
-    # Cookies are not considered for equality.
+    # Cookie jars are not considered for equality.
     def __eq__(self, other):
         return (self.method == other.method and self.method_data == other.method_data)
 
     def __hash__(self):
-        return hash(hash(self.method) + hash(self.method_data))
+        if self._hash is None:
+            self._hash = hash(hash(self.method) + hash(self.method_data))
+        return self._hash
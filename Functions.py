@@ -8,7 +8,7 @@ from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, UnexpectedAlertPresentException, NoSuchFrameException, NoAlertPresentException, ElementNotVisibleException, InvalidElementStateException
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, parse_qsl
 import json
 import pprint
 import datetime
@@ -20,13 +20,13 @@ import random
 import re
 import logging
 import copy
+from contextlib import nullcontext
 import time
-import operator
 
 import Classes
 from Utils import is_same_page
 from extractors.Events import extract_events
-from extractors.Forms import extract_forms, parse_form
+from extractors.Forms import extract_forms, parse_form, parse_forms
 from extractors.Urls import extract_urls
 from extractors.Iframes import extract_iframes
 
@@ -68,25 +68,31 @@ def remove_alerts(driver):
 
 
 
+# Both depths are computed when the edge is created
 def depth(edge):
-    depth = 1
-    while edge.parent:
-        depth = depth + 1
-        edge = edge.parent
-    return depth
+    return edge.depth
 
 def dom_depth(edge):
-    depth = 1
-    while edge.parent and edge.value.method == "event":
-        depth = depth + 1
-        edge = edge.parent
-    return depth
+    return edge.dom_depth
 
 # Execute the path necessary to reach the state
-def find_state(original_url, driver, graph, edge):
+# If the browser is already in the state of an edge on the path only the
+# rest of the path is executed. Otherwise, with a cookie_store, the
+# deepest state on the path that has a snapshot is restored first (see
+# restore_state). lock guards the graph when several workers share it,
+# settle is (quiet, timeout) for wait_for_settle after a restore.
+def find_state(original_url, driver, graph, edge, cookie_store=None, lock=None, settle=(0.3, 3.0)):
     path = rec_find_path(graph, edge)
 
-    for edge_in_path in path:
+    start = current_prefix(driver, graph, path)
+    if start:
+        logging.info("Browser is in the state of %s, skipped %d edges" % (str(path[start - 1]), start))
+        with lock or nullcontext():
+            graph.data['replays_avoided'] = graph.data.get('replays_avoided', 0) + 1
+    elif cookie_store is not None:
+        start = restore_state(driver, graph, path, cookie_store, lock, settle)
+
+    for edge_in_path in path[start:]:
         method = edge_in_path.value.method
         method_data = edge_in_path.value.method_data
         logging.info("find_state method %s" % method)
@@ -141,18 +147,106 @@ def find_state(original_url, driver, graph, edge):
     return True
 
 
-# Recursively follows parent until a stable node is found.
+# (url, structural fingerprint) of the page in the browser, None if the
+# page can't tell (scripts not injected)
+def current_state(driver):
+    try:
+        return tuple(driver.execute_script("return page_state()"))
+    except Exception:
+        return None
+
+
+# Length of the longest prefix of path (without the last edge) that leads
+# to the state the browser is in, 0 if there is none
+def current_prefix(driver, graph, path):
+    current = current_state(driver)
+    if current is None:
+        return 0
+    for i in range(len(path) - 2, -1, -1):
+        if graph.edge_states.get(path[i]) == current:
+            return i + 1
+    return 0
+
+
+# Restores the snapshot of the deepest edge in path (but the last one)
+# that has one. Returns the index in path to continue from, 0 if nothing
+# was restored and the whole path has to be replayed.
+def restore_state(driver, graph, path, cookie_store, lock=None, settle=(0.3, 3.0)):
+    # The first edge is a GET, restoring it is not faster than loading it
+    for i in range(len(path) - 2, 0, -1):
+        with lock or nullcontext():
+            snapshot = graph.snapshots.get(path[i])
+            if snapshot is not None:
+                cookies = cookie_store.get(snapshot[1])
+        if snapshot is None:
+            continue
+        restored = restore_snapshot(driver, snapshot, cookies, settle)
+        with lock or nullcontext():
+            if restored:
+                logging.info("Restored state of %s, skipped %d edges" % (str(path[i]), i + 1))
+                graph.data['snapshot_restores'] = graph.data.get('snapshot_restores', 0) + 1
+                return i + 1
+            # The state depends on more than cookies, storage and url
+            logging.info("Snapshot of %s did not restore its state, replaying" % str(path[i]))
+            graph.data['snapshot_failures'] = graph.data.get('snapshot_failures', 0) + 1
+            graph.snapshots.pop(path[i], None)
+        break
+    return 0
+
+
+# Loads the url of a snapshot with its cookies and storage and checks that
+# the page is in the recorded state. If it is not, the cookies and storage
+# the browser had before are put back for the replay.
+def restore_snapshot(driver, snapshot, cookies, settle=(0.3, 3.0)):
+    (dom_state, cookie_id, storage) = snapshot
+    url = dom_state[0]
+    try:
+        session = (driver.current_url, driver.get_cookies(), driver.execute_script("return storage_snapshot()"))
+    except Exception as e:
+        logging.warning("Could not save the session before restoring a snapshot: " + str(e))
+        return False
+    try:
+        load_session(driver, url, cookies, storage)
+        wait_for_settle(driver, *settle)
+        if tuple(driver.execute_script("return page_state()")) == dom_state:
+            return True
+    except Exception as e:
+        logging.warning("Could not restore snapshot: " + str(e))
+    try:
+        load_session(driver, *session)
+    except Exception as e:
+        logging.warning("Could not put back the session: " + str(e))
+    return False
+
+
+# Replaces the cookies and storage (see storage_snapshot) of url's origin
+# and loads url
+def load_session(driver, url, cookies, storage):
+    # Cookies and storage can only be set for the loaded origin
+    if not same_origin(driver.current_url, url):
+        driver.get(url)
+    driver.delete_all_cookies()
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            logging.warning("Could not restore cookie %s: %s" % (cookie.get("name"), str(e)))
+    driver.execute_script("restore_storage(arguments[0]);", storage)
+    driver.get(url)
+
+
+# Follows parent until a stable node is found.
 # Stable in this case would be defined as a GET
+# Paths share their prefixes through the parent links, every edge only
+# knows the length of its path (Edge.path_len). Built on each call,
+# iteratively (no recursion limit).
 def rec_find_path(graph, edge):
-    path = []
-    method = edge.value.method
-    parent = edge.parent
-
-    # This is the base case since the first request is always get.
-    if method == "get":
-        return path + [edge]
-    else:
-        return rec_find_path(graph, parent) + [edge]
+    path = [None] * edge.path_len
+    current = edge
+    for i in range(edge.path_len - 1, -1, -1):
+        path[i] = current
+        current = current.parent
+    return tuple(path)
 
 
 def edge_sort(edge):
@@ -172,12 +266,15 @@ def check_edge(driver, graph, edge):
     # TODO use default FALSE/TRUE
     if method == "get":
         if allow_edge(graph, edge):
-            purl = urlparse(edge.n2.value.url)
-            if not purl.path in graph.data['urls']:
-                graph.data['urls'][purl.path] = 0
-            graph.data['urls'][purl.path] += 1
+            (path, _, _) = graph.index_link(edge)
+            if graph.visit_url(path) > 120:
+                return False
 
-            if graph.data['urls'][purl.path] > 120:
+            # Crawler traps, calendars, pagination etc.
+            template = graph.link_template(edge)
+            budget = graph.data.get('template_budget', 50)
+            if graph.visit_template(template) > budget:
+                logging.info("Url template %s visited more than %d times, discard edge %s" % (template, budget, str(edge)))
                 return False
             else:
                 return True
@@ -206,7 +303,9 @@ def check_edge(driver, graph, edge):
 
 
 
-def follow_edge(original_url, driver, graph, edge):
+# With wait=False GETs only start loading the page, see start_get
+def follow_edge(original_url, driver, graph, edge, wait=True, cookie_store=None, lock=None,
+                settle=(0.3, 3.0)):
     logging.info("Follow edge: " + str(edge))
     method = edge.value.method
     method_data = edge.value.method_data
@@ -214,40 +313,49 @@ def follow_edge(original_url, driver, graph, edge):
         logging.info("compare urls: " + str(original_url) + " " + str(edge.n2.value.url))
         print("compare urls: ", original_url, edge.n2.value.url)
         if is_same_page(original_url, edge.n2.value.url):
-            driver.get(edge.n2.value.url)
+            if wait:
+                driver.get(edge.n2.value.url)
+            else:
+                start_get(driver, edge.n2.value.url)
         else:
             logging.info("Urls are not from the same webpage. ignore...")
-            edge.visited = True
+            with lock or nullcontext():
+                graph.visit_edge(edge)
             return None
     elif method == "form":
         logging.info("Form, do find_state")
-        if not find_state(original_url, driver, graph, edge):
+        if not find_state(original_url, driver, graph, edge, cookie_store, lock, settle):
             logging.warning("Could not find state %s" % str(edge))
-            edge.visited = True
+            with lock or nullcontext():
+                graph.visit_edge(edge)
             return None
     elif method == "event":
         logging.info("Event, do find_state")
-        if not find_state(original_url, driver, graph, edge):
+        if not find_state(original_url, driver, graph, edge, cookie_store, lock, settle):
             logging.warning("Could not find state %s" % str(edge))
-            edge.visited = True
+            with lock or nullcontext():
+                graph.visit_edge(edge)
             return None
     elif method == "iframe":
         logging.info("iframe, do find_state")
-        if not find_state(original_url, driver, graph, edge):
+        if not find_state(original_url, driver, graph, edge, cookie_store, lock, settle):
             logging.warning("Could not find state %s" % str(edge))
-            edge.visited = True
+            with lock or nullcontext():
+                graph.visit_edge(edge)
             return None
     elif method == "javascript":
         logging.info("Javascript, do find_state")
-        if not find_state(original_url, driver, graph, edge):
+        if not find_state(original_url, driver, graph, edge, cookie_store, lock, settle):
             logging.warning("Could not find state %s" % str(edge))
-            edge.visited = True
+            with lock or nullcontext():
+                graph.visit_edge(edge)
             return None
     elif method == "ui_form":
         logging.info("ui_form, do find_state")
-        if not find_state(original_url, driver, graph, edge):
+        if not find_state(original_url, driver, graph, edge, cookie_store, lock, settle):
             logging.warning("Could not find state %s" % str(edge))
-            edge.visited = True
+            with lock or nullcontext():
+                graph.visit_edge(edge)
             return None
     else:
         raise Exception("Can't handle method (%s) in next_unvisited_edge " % method)
@@ -258,6 +366,78 @@ def follow_edge(original_url, driver, graph, edge):
 
 
 
+# Urls that are most likely downloaded instead of shown
+download_extensions = (".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".rar", ".7z", ".tar",
+                       ".exe", ".msi", ".dmg", ".apk", ".iso", ".bin",
+                       ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".odt", ".csv")
+
+
+# Navigates without waiting for the page to load, unlike driver.get.
+# The flag only exists in the old document, page_loaded() is False
+# until the new one has replaced it and finished loading. Urls that only
+# change the fragment stay in the same document, so they are not flagged.
+# Downloads never replace the document either, they are loaded with
+# driver.get, which returns once the download started.
+def start_get(driver, url):
+    if urlparse(url).path.lower().endswith(download_extensions):
+        driver.get(url)
+        return
+    driver.execute_script("var target = new URL(arguments[0], window.location.href).href;"
+                          "var same_document = target.indexOf('#') >= 0 && "
+                          "    target.split('#')[0] == window.location.href.split('#')[0];"
+                          "window.blackwidow_leaving = !same_document;"
+                          "window.location.href = target;", url)
+
+
+def page_loaded(driver, quiet=0.3):
+    return driver.execute_script("return !window.blackwidow_leaving && "
+                                 "(typeof page_settled === 'undefined' ? "
+                                 "document.readyState == 'complete' : page_settled(arguments[0]));",
+                                 int(quiet * 1000))
+
+
+# Runs the timers of the page that are due within horizon seconds, in one
+# call (flush_timers in timing_wrapper.js). Returns the number of callbacks run.
+def flush_timers(driver, horizon=30.0, max_calls=1000):
+    try:
+        calls = driver.execute_script("return flush_timers(arguments[0], arguments[1]);",
+                                      int(horizon * 1000), max_calls)
+        logging.info("Flushed %s timer callbacks" % str(calls))
+        return calls
+    except UnexpectedAlertPresentException:
+        logging.warning("Alert detected")
+        remove_alerts(driver)
+    except Exception as e:
+        logging.warning("Could not flush timers: " + str(e))
+    return 0
+
+
+# Blocks until the page has no requests in flight and no DOM changes for
+# quiet seconds, or until timeout seconds. Returns True if it settled.
+def wait_for_settle(driver, quiet=0.3, timeout=3.0):
+    for attempt in range(2):
+        try:
+            return driver.execute_async_script("wait_for_settle(arguments[0], arguments[1], arguments[2]);",
+                                               int(quiet * 1000), int(timeout * 1000))
+        except UnexpectedAlertPresentException:
+            logging.warning("Alert detected")
+            remove_alerts(driver)
+        except Exception as e:
+            logging.warning("Could not wait for the page to settle: " + str(e))
+            return False
+    return False
+
+
+# Requests in flight in the page as (counted, all), see settle_pending
+# in lib.js. None if the page can not tell.
+def requests_in_flight(driver):
+    try:
+        (counted, total) = driver.execute_script("return [settle_pending(), settle_tracker.requests.size];")
+        return (int(counted), int(total))
+    except Exception:
+        return None
+
+
 # Checks if two URLs target the same origin
 def same_origin(u1, u2):
     p1 = urlparse(u1)
@@ -323,11 +503,13 @@ def execute_event(original_url, driver, do):
     logging.info("We need to trigger [" + do.event + "] on " + do.addr)
     print("We need to trigger [" + do.event + "] on " + do.addr)
 
-    do.addr = xpath_row_to_cell(do.addr)
+    # Don't write back to the event, its address is part of its hash and
+    # the event is stored in the graph indexes.
+    addr = xpath_row_to_cell(do.addr)
 
     try:
         if   do.event == "onclick" or do.event == "click":
-            web_element =  driver.find_element(By.XPATH, do.addr)
+            web_element =  driver.find_element(By.XPATH, addr)
             logging.info("Click on %s" % web_element )
             print("Click on %s" % web_element.get_attribute)
             href_value = web_element.get_attribute('href')
@@ -338,32 +520,32 @@ def execute_event(original_url, driver, do):
                     logging.warning("Trying to click on invisible element. Use JavaScript")
                     driver.execute_script("arguments[0].click()", web_element)
         elif do.event == "ondblclick" or do.event == "dblclick":
-            web_element =  driver.find_element(By.XPATH,do.addr)
+            web_element =  driver.find_element(By.XPATH,addr)
             href_value = web_element.get_attribute('href')
             if href_value is None or is_same_page(original_url, href_value):
                 logging.info("Double click on %s" % web_element )
                 ActionChains(driver).double_click(web_element).perform()
         elif do.event == "onmouseout":
-            logging.info("Mouseout on %s" %  driver.find_element(By.XPATH,do.addr) )
-            driver.find_element(By.XPATH,do.addr).click()
-            el = driver.find_element(By.XPATH,do.addr)
+            logging.info("Mouseout on %s" %  driver.find_element(By.XPATH,addr) )
+            driver.find_element(By.XPATH,addr).click()
+            el = driver.find_element(By.XPATH,addr)
             # TODO find first element in body
             body = driver.find_element(By.XPATH,"/html/body")
             ActionChains(driver).move_to_element(el).move_to_element(body).perform()
         elif do.event == "onmouseover":
-            logging.info("Mouseover on %s" %  driver.find_element(By.XPATH,do.addr) )
-            el = driver.find_element(By.XPATH,do.addr)
+            logging.info("Mouseover on %s" %  driver.find_element(By.XPATH,addr) )
+            el = driver.find_element(By.XPATH,addr)
             ActionChains(driver).move_to_element(el).perform()
         elif  do.event == "onmousedown":
-            logging.info("Click (mousedown) on %s" %  driver.find_element(By.XPATH,do.addr) )
-            driver.find_element(By.XPATH,do.addr).click()
+            logging.info("Click (mousedown) on %s" %  driver.find_element(By.XPATH,addr) )
+            driver.find_element(By.XPATH,addr).click()
         elif  do.event == "onmouseup":
-            logging.info("Mouseup on %s" %  driver.find_element(By.XPATH,do.addr) )
-            el = driver.find_element(By.XPATH,do.addr)
+            logging.info("Mouseup on %s" %  driver.find_element(By.XPATH,addr) )
+            el = driver.find_element(By.XPATH,addr)
             ActionChains(driver).move_to_element(el).release().perform()
         elif  do.event == "change" or do.event == "onchange":
-            el = driver.find_element(By.XPATH,do.addr)
-            logging.info("Change %s" %  driver.find_element(By.XPATH,do.addr) )
+            el = driver.find_element(By.XPATH,addr)
+            logging.info("Change %s" %  driver.find_element(By.XPATH,addr) )
             if el.tag_name == "select":
                 # If need to change a select we try the different
                 # options
@@ -380,27 +562,27 @@ def execute_event(original_url, driver, do):
                             alert.dismiss()
             else:
                 # If ot a <select> we try to write
-                el = driver.find_element(By.XPATH,do.addr)
+                el = driver.find_element(By.XPATH,addr)
                 url = el.get_attribute('href')
                 if url is None or is_same_page(original_url, url):
                     el.clear()
                     el.send_keys("jAEkPot")
                     el.send_keys(Keys.RETURN)
         elif  do.event == "input" or do.event == "oninput":
-            el = driver.find_element(By.XPATH,do.addr)
+            el = driver.find_element(By.XPATH,addr)
             el.clear()
             el.send_keys("jAEkPot")
             el.send_keys(Keys.RETURN)
-            logging.info("oninput %s" %  driver.find_element(By.XPATH,do.addr) )
+            logging.info("oninput %s" %  driver.find_element(By.XPATH,addr) )
 
         elif  do.event == "compositionstart":
-            el = driver.find_element(By.XPATH,do.addr)
+            el = driver.find_element(By.XPATH,addr)
             url = el.get_attribute('href')
             if url is None or is_same_page(original_url, url):
                 el.clear()
                 el.send_keys("jAEkPot")
                 el.send_keys(Keys.RETURN)
-                logging.info("Composition Start %s" %  driver.find_element(By.XPATH,do.addr) )
+                logging.info("Composition Start %s" %  driver.find_element(By.XPATH,addr) )
 
         else:
             logging.warning("Warning Unhandled event %s " % str(do.event) )
@@ -465,8 +647,13 @@ def form_fill(original_url,driver, target_form):
         pass
 
     elem = driver.find_elements(By.TAG_NAME, "form")
-    for el in elem:
-        current_form = parse_form(el, driver)
+    # Parse all forms in one go, both lists are in document order
+    parsed_forms = parse_forms(driver)
+    if len(parsed_forms) != len(elem):
+        logging.warning("Form count changed while filling, parsing forms one by one")
+        parsed_forms = [parse_form(el, driver) for el in elem]
+
+    for (el, current_form) in zip(elem, parsed_forms):
 
         submit_buttons = []
 
@@ -478,7 +665,7 @@ def form_fill(original_url,driver, target_form):
         if not inputs:
             inputs = []
             logging.warning("No inputs founds, falling back to JavaScript")
-            resps = driver.execute_script("return get_forms()")
+            resps = driver.execute_script("return get_form_elements()")
             js_forms = json.loads(resps)
             for js_form in js_forms:
                 current_form = Classes.Form()
@@ -487,8 +674,8 @@ def form_fill(original_url,driver, target_form):
 
                 # TODO Need better COMPARE!
                 if( current_form.action == target_form.action and current_form.method ==  target_form.method ):
-                    for js_el in js_form['elements']:
-                        web_el = driver.find_element(By.XPATH,js_el['xpath'])
+                    for xpath in js_form['xpaths']:
+                        web_el = driver.find_element(By.XPATH,xpath)
                         inputs.append(web_el)
                     break
 
@@ -901,8 +1088,9 @@ def enter_iframe(driver, target_frame):
             return False
     return False
 
-def find_login_form(original_url, driver, graph, early_state=False):
-    forms = extract_forms(original_url, driver)
+def find_login_form(original_url, driver, graph, early_state=False, forms=None):
+    if forms is None:
+        forms = extract_forms(original_url, driver)
     for form in forms:
         for form_input in form.inputs:
             if form_input.itype == "password":
@@ -916,42 +1104,43 @@ def find_login_form(original_url, driver, graph, early_state=False):
                 return form
 
 
-def linkrank(link_edges, visited_list):
-    tups = []
-    for edge in link_edges:
-        url = edge.n2.value.url
-        purl = urlparse(edge.n2.value.url)
-
-        queries = len(purl.query.split("&"))
-        depth = len(purl.path.split("/"))
-
-        visited = 0
-        if purl.path in visited_list:
-            visited = 1
+# Static part of the link rank, (path, depth, queries)
+def link_features(url):
+    purl = urlparse(url)
 
-        tups.append( (edge, (visited, depth, queries)) )
+    queries = len(purl.query.split("&"))
+    depth = len(purl.path.split("/"))
 
-    tups.sort(key = operator.itemgetter(1))
+    return (purl.path, depth, queries)
 
-    return [edge for (edge, _) in tups]
+# Path segments that are ids rather than structure
+uuid_segment = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+hash_segment = re.compile(r"[0-9a-fA-F]{16,}")
+date_segment = re.compile(r"\d{4}-\d{1,2}(-\d{1,2})?")
 
-def new_files(link_edges, visited_list):
-    tups = []
-    for edge in link_edges:
-        url = edge.n2.value.url
-        purl = urlparse(edge.n2.value.url)
-        path = purl.path
+def template_segment(segment):
+    if uuid_segment.fullmatch(segment) or hash_segment.fullmatch(segment):
+        return "{h}"
+    if date_segment.fullmatch(segment):
+        return "{d}"
+    # Numbers, also inside segments like article-123.html or page2
+    return re.sub(r"\d+", "{n}", segment)
 
-        if path not in visited_list:
-            print("New file/path: ", path)
+# Structure of a url, urls that only differ in ids, dates and parameter
+# values share a template. E.g. both http://x/article/12?page=3 and
+# http://x/article/57?page=1 are x/article/{n}?page={}
+def url_template(url):
+    purl = urlparse(url)
 
-        tups.append( (edge, (path in visited_list, path)) )
+    path = "/".join([template_segment(segment) for segment in purl.path.split("/")])
 
-    tups.sort(key = operator.itemgetter(1))
-    print(tups)
-    input("OK tups?")
+    names = sorted(set([name for (name, _) in parse_qsl(purl.query, keep_blank_values=True)]))
+    query = "&".join([name + "={}" for name in names])
 
-    return [edge for (edge, _) in tups]
+    template = purl.netloc + path
+    if query:
+        template += "?" + query
+    return template
 
 
 # Returns None if the string is empty, otherwise just the string
@@ -1,4 +1,5 @@
 from urllib.parse import urlparse
+import json
 
 
 def is_same_page(url1, url2):
@@ -23,4 +24,12 @@ def is_same_page(url1, url2):
             parsed1.scheme == parsed2.scheme and
             parsed1.netloc == parsed2.netloc and
             path1 == path2
-    )
\ No newline at end of file
+    )
+
+
+def read_graph_jsonl(file_path):
+    """Yields the node and edge records of a graph written by Graph.export_jsonl, one at a time."""
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,46 @@
+// Microbenchmark for the handler hashing done by the injected wrappers.
+//
+// Simulates a page with listener/timer churn: a pool of handlers (jQuery
+// style, a few hundred bytes of source each) registered over and over,
+// and compares hashing every registration with MD5 against the memoized
+// function_hash() from js/lib.js.
+//
+// Needs js/md5.js and js/lib.js loaded first, see hash_bench.html.
+
+function hash_bench_handlers(count) {
+  var handlers = [];
+  for (var i = 0; i < count; i++) {
+    var body = "var el = this; var data = jQuery.data(el, 'events_" + i + "');" +
+               "if (data && data.handlers) { for (var k = 0; k < data.handlers.length; k++) {" +
+               "var handler = data.handlers[k]; if (handler.selector && !el.matches(handler.selector)) continue;" +
+               "var ret = handler.handler.apply(el, arguments); if (ret === false) { return false; } } }" +
+               "return jQuery.event.dispatch.apply(el, arguments);";
+    handlers.push(new Function("event", body));
+  }
+  return handlers;
+}
+
+function hash_bench_time(name, calls, handlers, hash) {
+  var start = Date.now();
+  var sink = 0;
+  for (var i = 0; i < calls; i++) {
+    sink += hash(handlers[i % handlers.length]).length;
+  }
+  var elapsed = Date.now() - start;
+  return name + ": " + calls + " registrations of " + handlers.length + " handlers in " +
+         elapsed + " ms (" + (elapsed * 1000 / calls).toFixed(2) + " us each)";
+}
+
+function run_hash_bench(calls, pool) {
+  calls = calls || 20000;
+  pool = pool || 200;
+  var results = [];
+  results.push(hash_bench_time("MD5(f.toString())", calls, hash_bench_handlers(pool),
+                               function(f) { return MD5(f.toString()); }));
+  results.push(hash_bench_time("string_hash(f.toString())", calls, hash_bench_handlers(pool),
+                               function(f) { return string_hash(f.toString()); }));
+  // Fresh functions, so the cache starts empty like on a new page
+  results.push(hash_bench_time("function_hash(f)", calls, hash_bench_handlers(pool),
+                               function_hash));
+  return results;
+}
@@ -0,0 +1,101 @@
+# Memory benchmark for the crawl data model.
+#
+# Builds a synthetic crawl graph the way rec_crawl does (every page links
+# to many shared urls, has a few forms and events, every edge gets its own
+# CrawlEdge, cookie jars go through a CookieStore) and reports the peak
+# traced memory and the peak RSS.
+#
+# Run from the repository root:
+#   python3 bench/memory.py [pages] [links per page]
+
+import os
+import sys
+import time
+import random
+import resource
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.makedirs("logs", exist_ok=True)
+
+import Classes
+
+
+def build_graph(pages, links_per_page):
+    random.seed(6)
+    graph = Classes.Graph()
+    root = Classes.Request("ROOTREQ", "get")
+    graph.add(root)
+    graph.data['urls'] = {}
+
+    cookie_store = Classes.CookieStore()
+    graph.add(Classes.Request("https://example.com/", "get"))
+    graph.connect(root, Classes.Request("https://example.com/", "get"), Classes.CrawlEdge("get", None, None))
+
+    for page in range(pages):
+        edge = graph.edges[random.randrange(len(graph.edges))]
+        request = edge.n2.value
+
+        # A fresh jar per page, like driver.get_cookies(), with one cookie
+        # that only changes now and then
+        cookies = cookie_store.add([
+            {"name": "session", "value": "x" * 32, "domain": "example.com", "path": "/",
+             "httpOnly": True, "secure": False},
+            {"name": "last_seen", "value": str(page // 50), "domain": "example.com", "path": "/",
+             "httpOnly": False, "secure": False}])
+
+        # Urls are rebuilt from scratch for every page, like the extractors do
+        for link in range(links_per_page):
+            url = "https://example.com/section/%d/article/%d?ref=%d" % (link % 20, random.randrange(pages), link % 5)
+            req = Classes.Request(url, "get")
+            graph.add(req)
+            graph.connect(request, req, Classes.CrawlEdge("get", None, cookies), edge)
+
+        for i in range(2):
+            form = Classes.Form()
+            form.action = "https://example.com/search"
+            form.method = "get"
+            form.add_input("text", "q", "", None)
+            form.add_input("hidden", "page", str(i), None)
+            form.add_input("submit", "go", "Search", None)
+            req = Classes.Request(form.action, form.method)
+            graph.add(req)
+            graph.connect(request, req, Classes.CrawlEdge("form", form, cookies), edge)
+
+        for i in range(5):
+            event = Classes.Event("f%d" % i, "click", None, "BUTTON",
+                                  "/html/body/div[2]/div/ul/li[%d]/button" % (i + 1), "btn")
+            req = Classes.Request(request.url, "event")
+            graph.add(req)
+            graph.connect(request, req, Classes.CrawlEdge("event", event, cookies), edge)
+
+    return graph
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    links_per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    tracemalloc.start()
+    start_time = time.time()
+    graph = build_graph(pages, links_per_page)
+    elapsed = time.time() - start_time
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        max_rss = max_rss // 1024
+
+    print("pages:           %d" % pages)
+    print("nodes:           %d" % len(graph.nodes))
+    print("edges:           %d" % len(graph.edges))
+    print("build time:      %.2fs (traced)" % elapsed)
+    print("traced current:  %.1f MB" % (current / 1024 / 1024))
+    print("traced peak:     %.1f MB" % (peak / 1024 / 1024))
+    print("peak RSS:        %.1f MB" % (max_rss / 1024))
+
+
+if __name__ == "__main__":
+    main()
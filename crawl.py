@@ -9,6 +9,7 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.edge.options import Options as EdgeOptions
 from selenium.webdriver.chrome.service import Service as ChromeService
 from Classes import *
+from Utils import read_graph_jsonl
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -19,44 +20,46 @@ parser.add_argument("--debug", action='store_true',
                     help="Dont use path deconstruction and recon scan. Good for testing single URL")
 parser.add_argument("--url", help="Custom URL to crawl")
 parser.add_argument('--browser', type=str, required=True, help='The browser you want to use (firefox, chrome, or edge)')
+parser.add_argument("--resume", action='store_true',
+                    help="Continue from the last checkpoint in output/ for this url and browser")
+parser.add_argument("--template-budget", type=int, default=50,
+                    help="Max GETs per url template, e.g. /article/{n}?page={} (default 50)")
+parser.add_argument("--event-representatives", type=int, default=3,
+                    help="Events crawled per group of elements sharing a handler (default 3)")
+parser.add_argument("--workers", type=int, default=1,
+                    help="Number of browsers crawling in parallel (default 1)")
+parser.add_argument("--tabs", type=int, default=1,
+                    help="Number of tabs crawling in parallel in one browser (default 1)")
+parser.add_argument("--headless", action='store_true',
+                    help="Run the browser without a window")
+parser.add_argument("--block", type=str, default="",
+                    help="Resources not to load, comma separated: image,font,media,analytics or all")
+parser.add_argument("--settle-quiet", type=float, default=0.3,
+                    help="Seconds without requests or DOM changes before a page is extracted (default 0.3)")
+parser.add_argument("--settle-timeout", type=float, default=3.0,
+                    help="Max seconds to wait for a page to settle (default 3)")
+parser.add_argument("--timer-horizon", type=float, default=30.0,
+                    help="Run the page's timers due within this many seconds before extracting it (default 30)")
 args = parser.parse_args()
+if args.tabs > 1 and args.workers > 1:
+    parser.error("--tabs and --workers can not be combined")
 
 
 # VISUALIZATION
-# Function to read the graph from a text file
-
-# Function to read the graph from a text file
+# Function to read the graph from the JSON Lines file written by Graph.export_jsonl
+# (output/<domain>-<browser>-graph.jsonl). The file is streamed record by record.
 def read_graph_from_file(file_path):
     edges = []
     edge_labels = {}
+    node_labels = {}
 
-    with open(file_path, 'r') as file:
-        content = file.read()
-
-        # Extract edges using regex
-        edges_section = re.search(r'Graph\[\{(.*?)\},', content, re.DOTALL)
-        if edges_section:
-            edges_data = edges_section.group(1).strip().split(',')
-
-            for edge in edges_data:
-                # Clean up edge format and create tuples
-                edge = edge.strip().replace('->', '->').replace('"', '').strip()
-                edge_tuple = tuple(edge.split(' -> '))
-                edges.append(edge_tuple)
-
-        # Extract edge labels using regex
-        labels_section = re.search(r'EdgeLabels -> \{(.*?)\},', content, re.DOTALL)
-        if labels_section:
-            labels_data = labels_section.group(1).strip().split('},')
-            for label in labels_data:
-                # Extract edge and label from the label string
-                label = label.strip()
-                if label:
-                    edge_label = re.match(r'\(\s*"(.*?)"\s*->\s*"(.*?)"\s*\)\s*->\s*"(.*)"', label)
-                    if edge_label:
-                        edge = (edge_label.group(1), edge_label.group(2))
-                        label_text = edge_label.group(3)
-                        edge_labels[edge] = label_text
+    for record in read_graph_jsonl(file_path):
+        if record['type'] == "node":
+            node_labels[record['id']] = "[" + str(record['method']) + "] " + str(record['url'])
+        elif record['type'] == "edge":
+            edge = (node_labels[record['from']], node_labels[record['to']])
+            edges.append(edge)
+            edge_labels[edge] = record['method'] + "," + record['data']
 
     return edges, edge_labels
 
@@ -73,16 +76,76 @@ for f in os.listdir(dynamic_path):
 WebDriver.add_script = add_script
 
 
+# Url patterns (Network.setBlockedURLs) per resource type of --block.
+# None of these are needed to find links, forms and events.
+blocked_extensions = {
+    "image": ["png", "jpg", "jpeg", "gif", "webp", "avif", "bmp", "ico", "svg"],
+    "font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "media": ["mp4", "webm", "ogg", "ogv", "mp3", "wav", "m4a", "flac", "mov", "avi"],
+}
+# Third party analytics and ad hosts, blocked as "analytics"
+blocked_hosts = ["google-analytics.com", "googletagmanager.com", "googlesyndication.com",
+                 "doubleclick.net", "connect.facebook.net", "hotjar.com", "segment.com",
+                 "mixpanel.com", "newrelic.com", "nr-data.net", "scorecardresearch.com",
+                 "quantserve.com", "adservice.google.com", "clarity.ms", "criteo.com"]
+
+
+def block_policy():
+    policy = set(b.strip() for b in args.block.split(",") if b.strip())
+    if "all" in policy:
+        policy = set(blocked_extensions) | {"analytics"}
+    return policy
+
+
+# Before any browser is started
+unknown_blocks = block_policy() - set(blocked_extensions) - {"analytics"}
+if unknown_blocks:
+    parser.error("unknown --block type(s): %s (use image, font, media, analytics or all)"
+                 % ", ".join(sorted(unknown_blocks)))
+
+
+def blocked_url_patterns(policy):
+    patterns = []
+    for resource_type in sorted(policy):
+        for extension in blocked_extensions.get(resource_type, []):
+            patterns.append("*." + extension)
+            patterns.append("*." + extension + "?*")
+    if "analytics" in policy:
+        for host in blocked_hosts:
+            patterns.append("*://" + host + "/*")
+            patterns.append("*." + host + "/*")
+    return patterns
+
+
+# Chromium only, applies to the current tab like add_script
+def block_resources(driver):
+    patterns = blocked_url_patterns(block_policy())
+    if patterns:
+        send(driver, "Network.enable")
+        send(driver, "Network.setBlockedURLs", {"urls": patterns})
+
+
 def set_up_chrome_driver():
     # launch Chrome
     chrome_options = webdriver.ChromeOptions()
     chrome_options.add_argument("--disable-web-security")
     chrome_options.add_argument("--disable-xss-auditor")
+    if args.headless:
+        chrome_options.add_argument("--headless=new")
 
     # Set up the Chrome driver
     service = ChromeService(ChromeDriverManager().install())
     driver = webdriver.Chrome(service=service, options=chrome_options)
 
+    add_chrome_scripts(driver)
+
+    return driver
+
+
+# The scripts and the blocked urls are added to the current tab only
+def add_chrome_scripts(driver):
+    block_resources(driver)
+
     # Read scripts and add script which will be executed when the page starts loading
     ## JS libraries from JaK crawler, with minor improvements
     driver.add_script(open("js/lib.js", "r").read())
@@ -93,18 +156,31 @@ def set_up_chrome_driver():
     driver.add_script(open("js/window_wrapper.js", "r").read())
     # Black Widow additions
     driver.add_script(open("js/forms.js", "r").read())
+    driver.add_script(open("js/snapshot.js", "r").read())
     driver.add_script(open("js/xss_xhr.js", "r").read())
     driver.add_script(open("js/remove_alerts.js", "r").read())
 
-    return driver
-
 
 def set_up_firefox_driver():
     # launch Firefox
     firefox_options = webdriver.FirefoxOptions()
     firefox_options.add_argument("--disable-web-security")
     firefox_options.add_argument("--disable-xss-auditor")
-
+    if args.headless:
+        firefox_options.add_argument("-headless")
+
+    # Firefox has no url blocking, use its preferences instead
+    policy = block_policy()
+    if "image" in policy:
+        firefox_options.set_preference("permissions.default.image", 2)
+    if "font" in policy:
+        firefox_options.set_preference("browser.display.use_document_fonts", 0)
+    if "media" in policy:
+        firefox_options.set_preference("media.autoplay.default", 5)
+        firefox_options.set_preference("media.preload.default", 0)
+        firefox_options.set_preference("media.preload.auto", 0)
+    if "analytics" in policy:
+        firefox_options.set_preference("privacy.trackingprotection.enabled", True)
 
     # Set up the Frefox driver
     service = Service(GeckoDriverManager().install())
@@ -120,24 +196,35 @@ def set_up_firefox_driver():
 
 
 def set_up_edge_driver():
-    # edge_options = EdgeOptions()
+    edge_options = EdgeOptions()
     # edge_options.set_capability("--disable-web-security")
     # edge_options.set_capability("--disable-xss-auditor")
+    if args.headless:
+        edge_options.add_argument("--headless=new")
 
     service = Service(EdgeChromiumDriverManager().install())
-    driver = webdriver.Edge(service=service)
+    driver = webdriver.Edge(service=service, options=edge_options)
+
+    block_resources(driver)
 
     return driver
 
 
 
 
-if args.browser == 'firefox':
-    driver = set_up_firefox_driver()
-elif args.browser == 'chrome':
-    driver = set_up_chrome_driver()
-else:  # edge
-    driver = set_up_edge_driver()
+def set_up_driver(browser):
+    if browser == 'firefox':
+        driver = set_up_firefox_driver()
+    elif browser == 'chrome':
+        driver = set_up_chrome_driver()
+    else:  # edge
+        driver = set_up_edge_driver()
+    # wait_for_settle blocks in execute_async_script for up to --settle-timeout
+    driver.set_script_timeout(max(30, args.settle_timeout + 10))
+    return driver
+
+
+driver = set_up_driver(args.browser)
 
 # driver.set_window_position(-1700,0)
 
@@ -147,8 +234,30 @@ else:  # edge
 if args.url:
     browser = args.browser
     url = args.url
-    Crawler(driver, url, browser).start(args.debug)
+    crawler = Crawler(driver, url, browser)
+    crawler.template_budget = args.template_budget
+    crawler.event_representatives = args.event_representatives
+    crawler.settle_quiet = args.settle_quiet
+    crawler.settle_timeout = args.settle_timeout
+    crawler.timer_horizon = args.timer_horizon
+    # One more browser per extra worker
+    for _ in range(args.workers - 1):
+        crawler.worker_drivers.append(set_up_driver(browser))
+    # or more tabs in the same browser
+    if args.tabs > 1:
+        crawler.tabs.append(driver.current_window_handle)
+        for _ in range(args.tabs - 1):
+            driver.switch_to.new_window('tab')
+            if browser == 'chrome':
+                add_chrome_scripts(driver)
+            elif browser == 'edge':
+                block_resources(driver)
+            crawler.tabs.append(driver.current_window_handle)
+        driver.switch_to.window(crawler.tabs[0])
+    crawler.start(args.debug, resume=args.resume)
     driver.quit()
+    for worker_driver in crawler.worker_drivers:
+        worker_driver.quit()
 
 else:
     print("Please use --url")
@@ -1,96 +1,20 @@
-from selenium.webdriver.common.by import By
-import json
-
 import Classes
+from extractors.Snapshot import extract_snapshot
 
 
-def extract_data_toggle(driver):
-    toggles = driver.find_elements(By.XPATH, "//button[@data-toggle]")
-    dos = []
-    for toggle in toggles:
-        xpath = driver.execute_script("return getXPath(arguments[0])", toggle)
-        do = {'function_id': '',
-              'event': 'click',
-              'id': toggle.get_attribute('id'),
-              'tag': 'button',
-              'addr': xpath,
-              'class': ''}
-        dos.append(do)
-
-    return dos
-
-
-def extract_inputs(driver):
-    toggles = driver.find_elements(By.XPATH, "//input")
-    dos = []
-    for toggle in toggles:
-        input_type = toggle.get_attribute("type")
-        if (not input_type) or input_type == "text":
-
-            in_form = toggle.find_elements(By.XPATH, ".//ancestor::form")
-            if not in_form:
-                xpath = driver.execute_script("return getXPath(arguments[0])", toggle)
-                do = {'function_id': '',
-                      'event': 'input',
-                      'id': toggle.get_attribute('id'),
-                      'tag': 'input',
-                      'addr': xpath,
-                      'class': ''}
-                dos.append(do)
-
-    toggles = driver.find_elements(By.XPATH, "//textarea")
-    for toggle in toggles:
-        xpath = driver.execute_script("return getXPath(arguments[0])", toggle)
-        do = {'function_id': '',
-              'event': 'input',
-              'id': toggle.get_attribute('id'),
-              'tag': 'input',
-              'addr': xpath,
-              'class': ''}
-        dos.append(do)
-
-    return dos
-
-
-def extract_fake_buttons(driver):
-    fake_buttons = driver.find_elements(By.CLASS_NAME, "btn")
-    dos = []
-    for button in fake_buttons:
-        xpath = driver.execute_script("return getXPath(arguments[0])", button)
-        do = {'function_id': '',
-              'event': 'click',
-              'id': button.get_attribute('id'),
-              'tag': 'a',
-              'addr': xpath,
-              'class': 'btn'}
-        dos.append(do)
-
-    return dos
-
-
-def extract_events(driver):
-    # Use JavaScript to find events
-    resps = driver.execute_script("return catch_properties()")
-    todo = json.loads(resps)
-
-    # From event listeners
-    resps = driver.execute_script("return JSON.stringify(added_events)")
-    todo += json.loads(resps)
-
-    # From data-toggle
-    resps = extract_data_toggle(driver)
-    todo += resps
+def extract_events(driver, snapshot=None):
+    if snapshot is None:
+        snapshot = extract_snapshot(driver)
 
+    # Collected by page_snapshot() from
+    #  - text inputs and textareas
+    #  - event handler properties (catch_properties)
+    #  - event listeners (added_events)
+    #  - buttons with data-toggle
+    #  - fake buttons, class="btn"
     # Only works in Chrome DevTools
     # resps = driver.execute_script("catch_event_listeners()");
-    # todo += resps
-
-    # From fake buttons class="btn"
-    resps = extract_fake_buttons(driver)
-    todo += resps
-
-    resps = extract_inputs(driver)
-    todo += resps
+    todo = snapshot['events']
 
     events = set()
     for do in todo:
@@ -99,7 +23,8 @@ def extract_events(driver):
                               do['id'],
                               do['tag'],
                               do['addr'],
-                              do['class'])
+                              do['class'],
+                              do.get('handler_id', do['function_id']))
         events.add(event)
 
     return events
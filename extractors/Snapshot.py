@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import json
+import logging
+
+
+# Python side of drain_properties() in js/property_obs.js.
+# Keeps the inline event handlers of the last few documents and applies
+# the changes reported by the page.
+class PropertyTracker:
+    def __init__(self, max_documents=20):
+        # doc id -> (seq, {key: handler})
+        self.documents = OrderedDict()
+        self.max_documents = max_documents
+
+    # What to send to drain_properties(), doc id -> last seen seq
+    def known_docs(self):
+        return {doc_id: seq for (doc_id, (seq, _)) in self.documents.items()}
+
+    def key(self, handler):
+        return (handler['event'], handler['function_id'], handler['addr'])
+
+    # Returns all handlers of the document after the changes
+    def update(self, drained):
+        doc_id = drained['doc_id']
+        if drained['reset'] or not doc_id in self.documents:
+            handlers = {}
+        else:
+            (_, handlers) = self.documents[doc_id]
+
+        for handler in drained['removed']:
+            handlers.pop(self.key(handler), None)
+        for handler in drained['added']:
+            handlers[self.key(handler)] = handler
+
+        self.documents[doc_id] = (drained['seq'], handlers)
+        self.documents.move_to_end(doc_id)
+        while len(self.documents) > self.max_documents:
+            self.documents.popitem(last=False)
+
+        logging.debug("Handlers in %s: %d added, %d removed, %d total" % (doc_id,
+                                                                         len(drained['added']),
+                                                                         len(drained['removed']),
+                                                                         len(handlers)))
+        return list(handlers.values())
+
+
+# One round trip to the browser for everything the extractors need.
+# See page_snapshot() in js/snapshot.js for the format.
+# With a PropertyTracker only the inline handlers that changed since the
+# last snapshot of the document are sent.
+def extract_snapshot(driver, tracker=None):
+    if tracker:
+        resps = driver.execute_script("return page_snapshot(arguments[0])", tracker.known_docs())
+        snapshot = json.loads(resps)
+        snapshot['events'] += tracker.update(snapshot['properties'])
+    else:
+        resps = driver.execute_script("return page_snapshot()")
+        snapshot = json.loads(resps)
+    logging.debug("Snapshot of %s: %d links, %d events" % (snapshot['url'],
+                                                           len(snapshot['links']),
+                                                           len(snapshot['events'])))
+    return snapshot
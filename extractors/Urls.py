@@ -1,14 +1,9 @@
-import time
-
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import StaleElementReferenceException
 from urllib.parse import urlparse, urljoin
-import json
-import traceback
 import re
 import logging
 
 import Classes
+from extractors.Snapshot import extract_snapshot
 
 
 # If the url is from a form then the form method is used
@@ -27,74 +22,34 @@ def url_to_request(url, form_method=None):
 
 
 # Looks for a and from urls
-def extract_urls(driver):
+def extract_urls(driver, snapshot=None):
+    if snapshot is None:
+        snapshot = extract_snapshot(driver)
+
     urls = set()
 
     # Search for urls in <a>
-    elem = driver.find_elements(By.TAG_NAME, "a")
-    for el in elem:
-        try:
-            if el.get_attribute("href"):
-                urls.add(url_to_request(el.get_attribute("href")))
-
-        except StaleElementReferenceException as e:
-            print("Stale pasta in from action")
-        except:
-            print("Failed to write element")
-            print(traceback.format_exc())
-
-    # Search for urls in <frame>
-    # elem = driver.find_elements(By.TAG_NAME,"frame")
-    elem = []
-    for el in elem:
-        try:
-            if el.get_attribute("src"):
-                urls.add(url_to_request(el.get_attribute("src")))
-
-        except StaleElementReferenceException as e:
-            print("Stale pasta in from action")
-        except:
-            print("Failed to write element")
-            print(traceback.format_exc())
+    for href in snapshot['links']:
+        urls.add(url_to_request(href))
 
     # Search for urls in <iframe>
-    elem = driver.find_elements(By.TAG_NAME, "iframe")
-    for el in elem:
-        try:
-            if el.get_attribute("src"):
-                urls.add(url_to_request(el.get_attribute("src")))
-
-        except StaleElementReferenceException as e:
-            print("Stale pasta in from action")
-        except:
-            print("Failed to write element")
-            print(traceback.format_exc())
+    # (<frame> is left out on purpose)
+    for iframe in snapshot['iframes']:
+        if iframe['tag'] == "iframe" and iframe['src']:
+            urls.add(url_to_request(iframe['src']))
 
     # Search for urls in <meta>
-    elem = driver.find_elements(By.TAG_NAME, "meta")
-    for el in elem:
-        try:
-
-            if el.get_attribute("http-equiv") and el.get_attribute("content"):
-                if el.get_attribute("http-equiv").lower() == "refresh":
-                    m = re.search("url=(.*)", el.get_attribute("content"), re.IGNORECASE)
-                    fresh_url = m.group(1)
-                    full_fresh_url = urljoin(driver.current_url, fresh_url)
-
-                    urls.add(url_to_request(full_fresh_url))
-
-        except StaleElementReferenceException as e:
-            print("Stale pasta in from action")
-        except:
-            print("Failed to write element")
-            print(traceback.format_exc())
-
+    for meta in snapshot['metas']:
+        if meta['http_equiv'].lower() == "refresh":
+            m = re.search("url=(.*)", meta['content'], re.IGNORECASE)
+            if m:
+                fresh_url = m.group(1)
+                full_fresh_url = urljoin(snapshot['url'], fresh_url)
 
-    resps = driver.execute_script("return JSON.stringify(window_open_urls)")
+                urls.add(url_to_request(full_fresh_url))
 
-    window_open_urls = json.loads(resps)
-    for window_open_url in window_open_urls:
-        full_window_open_url = urljoin(driver.current_url, window_open_url)
+    for window_open_url in snapshot['window_open_urls']:
+        full_window_open_url = urljoin(snapshot['url'], window_open_url)
         urls.add(url_to_request(full_window_open_url))
 
     # Search in comments
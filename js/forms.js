@@ -1,18 +1,114 @@
 
+
+// Every form of the page as get_form() models, see parse_forms
 function get_forms() {
+  var forms = document.forms;
+  var models = [];
+  for(var i = 0; i < forms.length; i++) {
+    models.push(get_form(forms[i]));
+  }
+  return JSON.stringify(models);
+}
+
+// Action, method and the xpaths of the controls of every form. Only
+// used by form_fill when a form has no <input> tags of its own.
+function get_form_elements() {
   var forms = document.forms;
   var obj_forms = [];
   for(var i = 0; i < forms.length; i++) {
-      form = {"action": forms[i].action,
-              "method": forms[i].method,
-              "elements": []};
-      els = forms[i].elements;
-      for(var j = 0; j < els.length; j++) {
-        form.elements.push( {"name": els[j].name,
-                             "type": els[j].type, 
-                             "xpath": getXPath(els[j])} );
-      }
-      obj_forms.push(form);
+    var form = {"action": forms[i].action,
+                "method": forms[i].method,
+                "xpaths": []};
+    var els = forms[i].elements;
+    for(var j = 0; j < els.length; j++) {
+      form.xpaths.push(getXPath(els[j]));
+    }
+    obj_forms.push(form);
   }
   return JSON.stringify(obj_forms);
 }
+
+// Everything extractors/Forms.py needs to build a Classes.Form,
+// see form_from_json(). Empty values are sent as null.
+function get_form(el) {
+  var model = {"action": null,
+               "method": null,
+               "inputs": [],
+               "selects": [],
+               "textareas": [],
+               "buttons": [],
+               "iframes": []};
+
+  // An input named "action" or "method" shadows the form properties
+  var action = typeof el.action == "string" ? el.action : el.getAttribute("action");
+  if( action ) {
+    model.action = action;
+    var method = typeof el.method == "string" ? el.method : el.getAttribute("method");
+    model.method = method || "get";
+  }
+
+  // <input> tags
+  var inputs = el.getElementsByTagName("input");
+  if( inputs.length == 0 ) {
+    // No inputs in the form element itself, use the elements of the
+    // first form with the same action and method instead
+    inputs = [];
+    var forms = document.forms;
+    for(var i = 0; i < forms.length; i++) {
+      if( forms[i].method == model.method && forms[i].action == model.action ) {
+        inputs = forms[i].elements;
+        break;
+      }
+    }
+  }
+  for(var i = 0; i < inputs.length; i++) {
+    model.inputs.push( {"type": inputs[i].type || null,
+                        "name": inputs[i].name || null,
+                        "value": inputs[i].value || null,
+                        "checked": inputs[i].checked ? true : null} );
+  }
+
+  // <select> and <option> tags
+  var selects = el.getElementsByTagName("select");
+  for(var i = 0; i < selects.length; i++) {
+    var options = [];
+    for(var j = 0; j < selects[i].options.length; j++) {
+      options.push(selects[i].options[j].value);
+    }
+    model.selects.push( {"name": selects[i].name || null,
+                         "options": options} );
+  }
+
+  // <textarea> tags
+  var textareas = el.getElementsByTagName("textarea");
+  for(var i = 0; i < textareas.length; i++) {
+    model.textareas.push( {"name": textareas[i].name || null,
+                           "value": textareas[i].value || null} );
+  }
+
+  // <button> tags, sent as they are
+  var buttons = el.getElementsByTagName("button");
+  for(var i = 0; i < buttons.length; i++) {
+    model.buttons.push( {"type": buttons[i].type,
+                         "name": buttons[i].name,
+                         "value": buttons[i].value} );
+  }
+
+  // <iframe> with <body contenteditable>
+  // editable is null when the frame can not be read from here (other
+  // origin), the Python side then switches into it by xpath.
+  var iframes = el.getElementsByTagName("iframe");
+  for(var i = 0; i < iframes.length; i++) {
+    var editable = null;
+    try {
+      var body = iframes[i].contentDocument.body;
+      editable = (body.getAttribute("contenteditable") == "true");
+    } catch(e) {
+    }
+    model.iframes.push( {"id": iframes[i].id,
+                         "editable": editable,
+                         "xpath": getXPath(iframes[i])} );
+  }
+
+  return model;
+}
@@ -126,14 +126,93 @@
  *
  */
 
-// Test for send wrapper (TODO)
-need_to_wait = false;
-var original = XMLHttpRequest.prototype['open'];
-XMLHttpRequest.prototype['open'] = function() {
-  need_to_wait = true;
-  return original.apply(this, arguments);
+// Requests in flight (id -> start time) and the time of the last network
+// and DOM activity, see page_settled() and wait_for_settle()
+var settle_tracker = {"requests": new Map(), "next_id": 0, "last_activity": Date.now()};
+// Requests open for longer than this (long polling, streams) no longer
+// keep the page from settling
+var settle_max_request_ms = 5000;
+// Before timing_wrapper.js wraps it, the polling is not a page timer
+var settle_set_timeout = window.setTimeout;
+
+function settle_activity() {
+  settle_tracker.last_activity = Date.now();
+}
+
+// Returns a function to call when the request is done
+function settle_request_start() {
+  var id = settle_tracker.next_id++;
+  settle_tracker.requests.set(id, Date.now());
+  settle_activity();
+  return function() {
+    settle_tracker.requests.delete(id);
+    settle_activity();
+  };
+}
+
+// Requests in flight that still count, see settle_max_request_ms
+function settle_pending() {
+  var now = Date.now();
+  var pending = 0;
+  settle_tracker.requests.forEach(function(start) {
+    if (now - start < settle_max_request_ms) {
+      pending++;
+    }
+  });
+  return pending;
+}
+
+var original_send = XMLHttpRequest.prototype['send'];
+XMLHttpRequest.prototype['send'] = function() {
+  var done = settle_request_start();
+  this.addEventListener("loadend", done);
+  try {
+    return original_send.apply(this, arguments);
+  } catch(e) {
+    this.removeEventListener("loadend", done);
+    done();
+    throw e;
+  }
+}
+
+if (typeof window.fetch === "function") {
+  var original_fetch = window.fetch;
+  window.fetch = function() {
+    var done = settle_request_start();
+    var request = original_fetch.apply(this, arguments);
+    request.then(done, done);
+    return request;
+  }
+}
+
+// Only added and removed nodes and text count, attributes change all the
+// time on pages with animations
+new MutationObserver(settle_activity).observe(document, {"childList": true,
+                                                         "subtree": true,
+                                                         "characterData": true});
+
+// True when the page has loaded, no request is in flight and nothing
+// happened for quiet_ms
+function page_settled(quiet_ms) {
+  return document.readyState == "complete" &&
+         settle_pending() == 0 &&
+         Date.now() - settle_tracker.last_activity >= quiet_ms;
+}
+
+// For execute_async_script, calls done with true once the page settled
+// or with false after timeout_ms
+function wait_for_settle(quiet_ms, timeout_ms, done) {
+  var start = Date.now();
+  (function check() {
+    if (page_settled(quiet_ms)) {
+      done(true);
+    } else if (Date.now() - start >= timeout_ms) {
+      done(false);
+    } else {
+      settle_set_timeout.call(window, check, 50);
+    }
+  })();
 }
-// End of test 
 
 function callbackWrap(object, property, argumentIndex, wrapperFactory) {
 	var original = object[property];
@@ -144,22 +223,10 @@ function callbackWrap(object, property, argumentIndex, wrapperFactory) {
 	return original;
 }
 
+// Longest timer delay, see virtual_timer_delay in timing_wrapper.js
 var max_waiting_time = 65000
 var min_waiting_time = 0
 
-function timingCallbackWrap(object, property, argumentIndex, wrapperFactory) {
-	var original = object[property];
-
-	object[property] = function() {
-		if (arguments[1] > max_waiting_time) {
-			arguments[1] = max_waiting_time
-		}
-		wrapperFactory(this, arguments);
-		return original.apply(this, arguments);
-	}
-	return original;
-}
-
 function callInterceptionWrapper(object, property, argumentIndex,
 		wrapperFactory) {
 	var original = object[property];
@@ -179,7 +246,6 @@ function XMLHTTPObserverOpen(elem, args) {
 	//console.log("Uniq Id set: " + random_num);
 	elem.jaeks_id = random_num;
 	//resp = JSON.stringify(resp);
-  timeouts.push(resp);
   console.log("Observer " + resp);
 	//jswrapper.xmlHTTPRequestOpen(resp)
 }
@@ -203,61 +269,134 @@ function openWrapper(elem, args) {
     window_open_urls.push(args[0])
 }
 
-timeouts = Array();
-function timeoutWrapper(elem, args) {
-	function_id = MD5(args[0].toString());
-	resp = {
-		"function_id" : function_id,
-		"function_name" : args[0].name,
-		"time" : args[1]
-	};
-  //resp = JSON.stringify(resp)
-  timeouts.push(resp);
-	//jswrapper.timeout(resp)
+// Fast non-cryptographic hash (cyrb53 style, but both 32 bit halves are
+// kept, so 64 bit) as 16 hex digits.
+// Only used to tell handlers apart, so it does not need to be cryptographic.
+function string_hash(str) {
+	var h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+	for (var i = 0; i < str.length; i++) {
+		var ch = str.charCodeAt(i);
+		h1 = Math.imul(h1 ^ ch, 2654435761);
+		h2 = Math.imul(h2 ^ ch, 1597334677);
+	}
+	h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+	h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+	return ("0000000" + (h2 >>> 0).toString(16)).slice(-8) + ("0000000" + (h1 >>> 0).toString(16)).slice(-8);
 }
 
-function intervallWrapper(elem, args) {
-	function_id = MD5(args[0].toString());
-	resp = {
-		"function_id" : function_id,
-		"time" : args[1]
-	};
-	resp = JSON.stringify(resp)
-	//jswrapper.intervall(resp)
+// Hash of a handler's source. Functions are hashed once and cached by
+// identity, so registering the same handler again is cheap.
+var function_hashes = new WeakMap();
+function function_hash(func) {
+	if (func === null || (typeof func !== "function" && typeof func !== "object")) {
+		// setTimeout("code", ...)
+		return string_hash(String(func));
+	}
+	var hash = function_hashes.get(func);
+	if (hash === undefined) {
+		hash = string_hash(func.toString());
+		function_hashes.set(func, hash);
+	}
+	return hash;
+}
+
+// XPaths are cached per element, together with the position of every
+// child of a parent, so siblings and descendants share the work. Any
+// change to the child lists of the document drops the caches.
+var xpath_cache = {"paths": new WeakMap(), "positions": new WeakMap()};
+
+function xpath_cache_reset() {
+	xpath_cache.paths = new WeakMap();
+	xpath_cache.positions = new WeakMap();
+}
+
+var xpath_observer = new MutationObserver(xpath_cache_reset);
+xpath_observer.observe(document, {"childList": true, "subtree": true});
+
+// "[n]" for the n-th child with the same tag, "" for the first one
+function xpath_position(element, cache) {
+	var parent = element.parentNode;
+	var positions = cache ? xpath_cache.positions.get(parent) : undefined;
+	if (positions === undefined) {
+		positions = new Map();
+		var counts = {};
+		var sibblings = parent.childNodes;
+		for (var i = 0; i < sibblings.length; i++) {
+			var tag = sibblings[i].tagName;
+			if (tag !== undefined) {
+				counts[tag] = (counts[tag] || 0) + 1;
+				positions.set(sibblings[i], counts[tag] > 1 ? '[' + counts[tag] + ']' : '');
+			}
+		}
+		if (cache) {
+			xpath_cache.positions.set(parent, positions);
+		}
+	}
+	return positions.get(element);
+}
+
+// Positional path of an element, ids are not used
+function xpath_positional(element) {
+	var chain = [];
+	var node = element;
+	for (; node && node.nodeType == 1 && !xpath_cache.paths.has(node); node = node.parentNode) {
+		if (!node.parentNode) {
+			// Detached element
+			return "";
+		}
+		chain.push(node);
+	}
+
+	var xpath = '';
+	// Only paths of elements in the document are cached, changes
+	// elsewhere are not observed
+	var cache = false;
+	if (node && node.nodeType == 1) {
+		xpath = xpath_cache.paths.get(node);
+		cache = true;
+	} else if (node && node.nodeType == 9) {
+		cache = true;
+	}
+
+	for (var i = chain.length - 1; i >= 0; i--) {
+		xpath = xpath + '/' + chain[i].tagName.toLowerCase() + xpath_position(chain[i], cache);
+		if (cache) {
+			xpath_cache.paths.set(chain[i], xpath);
+		}
+	}
+	return xpath;
 }
 
 function getXPath(element) {
 
 	try {
-		var xpath = '';
-
     // Updated by Benjamin
     if (element.id) {
       return '//*[@id="'+element.id+'"]';
     }
-    // 
-
-		for (; element && element.nodeType == 1; element = element.parentNode) {
-
-			var sibblings = element.parentNode.childNodes;
-			var same_tags = []
-			for (var i = 0; i < sibblings.length; i++) { // collecting same
-				if (element.tagName === sibblings[i].tagName) {
-					same_tags[same_tags.length] = sibblings[i]
-				}
-			}
+    //
 
-			var id = same_tags.indexOf(element) + 1;
-			id > 1 ? (id = '[' + id + ']') : (id = '');
-			xpath = '/' + element.tagName.toLowerCase() + id + xpath;
+		// Drop the caches if the DOM has changed since the last call
+		if (xpath_observer.takeRecords().length > 0) {
+			xpath_cache_reset();
 		}
-		return xpath;
+		return xpath_positional(element);
 	} catch (e) {
 		console.log("Error: " + e)
 		return "";
 	}
 }
 
+// getXPath for many elements in one call, e.g.
+// driver.execute_script("return getXPaths(arguments[0])", elements)
+function getXPaths(elements) {
+	var xpaths = [];
+	for (var i = 0; i < elements.length; i++) {
+		xpaths.push(getXPath(elements[i]));
+	}
+	return xpaths;
+}
+
 
 
 added_events = Array();
@@ -278,11 +417,11 @@ function addEventListenerWrapper(elem, args) {
 
   if( !dom_adress ) {
     console.log("No dom_adress, using fake-id")
-    elem.id = MD5(elem.outerHTML);
+    elem.id = string_hash(elem.outerHTML);
     dom_adress = '//*[@id="'+elem.id+'"]';
   }
 
-	function_id = MD5(args[1].toString())
+	function_id = function_hash(args[1])
 	resp = {
 		"event" : args[0],
 		"function_id" : function_id,
@@ -389,7 +528,7 @@ function bodyAddEventListenerWrapper(elem, args) {
 	dom_adress = "";
 	id = elem.id;
 	html_class = elem.className;
-	function_id = MD5(args[1].toString())
+	function_id = function_hash(args[1])
 	dom_adress = "/html/body"
 	resp = {
 		"event" : args[0],
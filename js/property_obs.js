@@ -16,92 +16,212 @@
  */
 
 
+var handler_properties = ["onclick", "onmouseover", "onabort", "onblur", "onchange",
+                          "oninput", "ondblclick", "onerror", "onfocus", "onkeydown",
+                          "onkeypress", "onkeyup", "onmousedown", "onmousemove",
+                          "onmouseout", "onmouseup"];
+
+// Inline event handlers of one element, in the catch_properties format
+function element_handlers(elem) {
+  var resps = []
+  var events = []
+  for (var k = 0; k < handler_properties.length; k++) {
+    if (elem[handler_properties[k]] != null) {
+      events.push({"method": handler_properties[k], "func": elem[handler_properties[k]]})
+    }
+  }
+  if (events.length > 0) {
+    var dom_adress = getXPath(elem);
+    var html_class = elem.className;
+    for (var j = 0; j < events.length; j++) {
+      //function_id = MD5(events[j].func.toString() )
+      var function_id = string_hash(function_hash(events[j].func) + dom_adress )
+      var resp = {
+        "function_id" : function_id,
+        // Same for every element with this handler, see Graph.event_class
+        "handler_id" : function_hash(events[j].func),
+        "event" : events[j].method,
+        "func" : events[j].func.toString(),
+        "id" : elem.id,
+        "tag" : elem.tagName,
+        "addr" : dom_adress,
+        "class" : html_class
+      }
+      resps.push(resp);
+    }
+  }
+  return resps;
+}
+
+// Full rescan of the document
 function catch_properties(){
 
-  resps = []
+  var resps = []
   var elems = document.getElementsByTagName('*')
   // console.log(elems.length + " elems found...")
   for (my_counter_i = 0; my_counter_i < elems.length; my_counter_i++) {
-    events = []
-    tag = elems[my_counter_i].tagName
-    dom_address = ""
-    id = elems[my_counter_i].id
-    if (elems[my_counter_i].onclick != null) {
-      events.push({"method": "onclick", "func": elems[my_counter_i].onclick})
-    }
-    if (elems[my_counter_i].onmouseover != null) {
-      events.push({"method": "onmouseover", "func": elems[my_counter_i].onmouseover})
-    }
-    if (elems[my_counter_i].onabort != null) {
-      events.push({"method": "onabort", "func": elems[my_counter_i].onabort})
-    }
-    if (elems[my_counter_i].onblur != null) {
-      events.push({"method": "onblur", "func": elems[my_counter_i].onblur})
-    }
-    if (elems[my_counter_i].onchange != null) {
-      events.push({"method": "onchange", "func": elems[my_counter_i].onchange})
-    }
-    if (elems[my_counter_i].oninput != null) {
-      events.push({"method": "oninput", "func": elems[my_counter_i].oninput})
-    }
-    if (elems[my_counter_i].ondblclick != null) {
-      events.push({"method": "ondblclick", "func": elems[my_counter_i].ondblclick})
-    }
-    if (elems[my_counter_i].onerror != null) {
-      events.push({"method": "onerror", "func": elems[my_counter_i].onerror})
-    }
-    if (elems[my_counter_i].onfocus != null) {
-      events.push({"method": "onfocus", "func": elems[my_counter_i].onfocus})
-    }
-    if (elems[my_counter_i].onkeydown != null) {
-      events.push({"method": "onkeydown", "func": elems[my_counter_i].onkeydown})
-    }
-    if (elems[my_counter_i].onkeypress != null) {
-      events.push({"method": "onkeypress", "func": elems[my_counter_i].onkeypress})
-    }
-    if (elems[my_counter_i].onkeyup != null) {
-      events.push({"method": "onkeyup", "func": elems[my_counter_i].onkeyup})
-    }
-    if (elems[my_counter_i].onmousedown != null) {
-      events.push({"method": "onmousedown", "func": elems[my_counter_i].onmousedown})
-    }
-    if (elems[my_counter_i].onmousemove != null) {
-      events.push({"method": "onmousemove", "func": elems[my_counter_i].onmousemove})
-    }
-    if (elems[my_counter_i].onmouseout != null) {
-      events.push({"method": "onmouseout", "func": elems[my_counter_i].onmouseout})
+    resps = resps.concat(element_handlers(elems[my_counter_i]));
+  }
+  return JSON.stringify(resps);
+}
+
+
+// Incremental version of catch_properties. A MutationObserver and the
+// on* property setters mark the elements that may have changed, and
+// drain_properties() only looks at those.
+var property_tracker = {
+  // Changes with every document, the Python side keeps one state per id
+  "doc_id": Date.now().toString(36) + "-" + Math.random().toString(36).slice(2),
+  // Number of drains so far
+  "seq": 0,
+  "scanned": false,
+  // element -> handlers reported for it
+  "known": new Map(),
+  // Elements to look at in the next drain
+  "dirty": new Set(),
+  // Elements that got or lost children, xpaths below them may be different
+  "parents": new Set(),
+  // Number of handlers set from JavaScript, part of dom_fingerprint()
+  "version": 0
+};
+
+function property_tracker_mark(elem) {
+  if (property_tracker.scanned && elem && elem.nodeType == 1) {
+    property_tracker.dirty.add(elem);
+  }
+}
+
+function property_tracker_record(records) {
+  if (!property_tracker.scanned) {
+    // The first drain scans everything anyway
+    return;
+  }
+  for (var i = 0; i < records.length; i++) {
+    var record = records[i];
+    if (record.type == "childList") {
+      property_tracker.parents.add(record.target);
+      for (var j = 0; j < record.addedNodes.length; j++) {
+        var node = record.addedNodes[j];
+        if (node.nodeType == 1) {
+          property_tracker_mark(node);
+          var children = node.getElementsByTagName('*');
+          for (var k = 0; k < children.length; k++) {
+            property_tracker_mark(children[k]);
+          }
+        }
+      }
+    } else {
+      property_tracker_mark(record.target);
     }
-    if (elems[my_counter_i].onmouseup != null) {
-      events.push({"method": "onmouseup", "func": elems[my_counter_i].onmouseup})
+  }
+}
+
+var property_observer = new MutationObserver(property_tracker_record);
+property_observer.observe(document, {"childList": true,
+                                     "subtree": true,
+                                     "attributes": true,
+                                     "attributeFilter": handler_properties.concat(["id", "class"])});
+
+// Handlers set as properties do not show up as mutations
+[window.HTMLElement, window.SVGElement].forEach(function(element_class) {
+  if (!element_class) {
+    return;
+  }
+  handler_properties.forEach(function(property) {
+    var descriptor = Object.getOwnPropertyDescriptor(element_class.prototype, property);
+    if (!descriptor || !descriptor.set || !descriptor.configurable) {
+      return;
+    }
+    Object.defineProperty(element_class.prototype, property, {
+      "get": descriptor.get,
+      "set": function(value) {
+        descriptor.set.call(this, value);
+        property_tracker.version++;
+        property_tracker_mark(this);
+      },
+      "enumerable": descriptor.enumerable,
+      "configurable": true
+    });
+  });
+});
+
+function property_key(resp) {
+  return resp.event + " " + resp.function_id + " " + resp.addr;
+}
+
+// Returns {doc_id, seq, reset, added, removed} with the handlers that
+// changed since the last drain. known_docs maps doc ids to the seq the
+// caller has seen; if it does not know this document at the current seq
+// everything is sent again with reset set.
+function drain_properties(known_docs) {
+  var tracker = property_tracker;
+  property_tracker_record(property_observer.takeRecords());
+
+  if (!tracker.scanned) {
+    var elems = document.getElementsByTagName('*');
+    for (var i = 0; i < elems.length; i++) {
+      tracker.dirty.add(elems[i]);
     }
-    //console.log("We have: " + events.length + " events");
-    if (events.length > 0) {
-      elem = elems[my_counter_i]
-      dom_adress = getXPath(elem);
-      html_class = elems[my_counter_i].className;
-      for (my_counter_j = 0; my_counter_j < events.length; my_counter_j++) {
-        //function_id = MD5(events[my_counter_j].func.toString() )
-        function_id = MD5(events[my_counter_j].func.toString() + dom_adress )
-
-        f = events[my_counter_j].func.toString()
-        e = events[my_counter_j].event_type
-        //clickable = JSON.parse(events[j])
-        tut1 = events[my_counter_j];
-        resp = {
-          "function_id" : function_id,
-          "event" : events[my_counter_j].method,
-          "func" : events[my_counter_j].func.toString(),
-          "id" : id,
-          "tag" : tag,
-          "addr" : dom_adress,
-          "class" : html_class
+    tracker.scanned = true;
+  }
+
+  // Elements that were removed or moved with their parent
+  if (tracker.parents.size > 0) {
+    tracker.known.forEach(function(resps, elem) {
+      if (!elem.isConnected) {
+        tracker.dirty.add(elem);
+        return;
+      }
+      for (var parent = elem.parentNode; parent; parent = parent.parentNode) {
+        if (tracker.parents.has(parent)) {
+          tracker.dirty.add(elem);
+          return;
         }
-        //resp = JSON.stringify(resp);
-        resps.push(resp);
       }
+    });
+    tracker.parents.clear();
+  }
+
+  var added = [];
+  var removed = [];
+  tracker.dirty.forEach(function(elem) {
+    var old_resps = tracker.known.get(elem) || [];
+    var new_resps = elem.isConnected ? element_handlers(elem) : [];
+
+    var old_keys = new Set(old_resps.map(property_key));
+    var new_keys = new Set(new_resps.map(property_key));
+    old_resps.forEach(function(resp) {
+      if (!new_keys.has(property_key(resp))) {
+        removed.push(resp);
+      }
+    });
+    new_resps.forEach(function(resp) {
+      if (!old_keys.has(property_key(resp))) {
+        added.push(resp);
+      }
+    });
+
+    if (new_resps.length > 0) {
+      tracker.known.set(elem, new_resps);
+    } else {
+      tracker.known.delete(elem);
     }
+  });
+  tracker.dirty.clear();
 
+  var reset = !(known_docs && known_docs[tracker.doc_id] === tracker.seq);
+  if (reset) {
+    added = [];
+    removed = [];
+    tracker.known.forEach(function(resps) {
+      added = added.concat(resps);
+    });
   }
-  return JSON.stringify(resps);
-}
+  tracker.seq++;
 
+  return {"doc_id": tracker.doc_id,
+          "seq": tracker.seq,
+          "reset": reset,
+          "added": added,
+          "removed": removed};
+}
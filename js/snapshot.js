@@ -0,0 +1,261 @@
+
+// Everything the extractors need from a page, collected in one call.
+// Returns a JSON string, see extractors/Snapshot.py
+// With known_docs the inline handlers are sent as changes since the last
+// call (drain_properties), otherwise the whole document is scanned.
+function page_snapshot(known_docs) {
+  var snapshot = {"url": document.location.href,
+                  "fingerprint": dom_fingerprint(),
+                  "links": [],
+                  "metas": [],
+                  "window_open_urls": window_open_urls,
+                  "iframes": [],
+                  "forms": JSON.parse(get_forms()),
+                  "ui_forms": {"sources": [], "buttons": []},
+                  "events": []};
+
+  // <a href>, href is already resolved against the page url
+  var links = document.getElementsByTagName("a");
+  for(var i = 0; i < links.length; i++) {
+    var href = links[i].href;
+    if( href && typeof href !== "string" ) {
+      // <a> inside <svg>
+      href = links[i].getAttribute("href");
+    }
+    if( href ) {
+      snapshot.links.push(href);
+    }
+  }
+
+  // <meta http-equiv content>, refresh urls are parsed in Python
+  var metas = document.getElementsByTagName("meta");
+  for(var i = 0; i < metas.length; i++) {
+    var http_equiv = metas[i].getAttribute("http-equiv");
+    var content = metas[i].getAttribute("content");
+    if( http_equiv && content ) {
+      snapshot.metas.push({"http_equiv": http_equiv, "content": content});
+    }
+  }
+
+  // <iframe> and <frame>
+  var tags = ["iframe", "frame"];
+  for(var t = 0; t < tags.length; t++) {
+    var frames = document.getElementsByTagName(tags[t]);
+    for(var i = 0; i < frames.length; i++) {
+      snapshot.iframes.push({"tag": tags[t],
+                             "src": frames[i].src || null,
+                             "id": frames[i].id ? frames[i].getAttribute("i") : null});
+    }
+  }
+
+  // One pass over the controls outside of forms, feeding both the
+  // ui_forms and the input events
+  var buttons = [];
+  var controls = document.querySelectorAll("input, textarea, button");
+  for(var i = 0; i < controls.length; i++) {
+    var control = controls[i];
+    var tag = control.tagName.toLowerCase();
+    if( tag == "input" && control.type !== "text" ) {
+      continue;
+    }
+    var in_form = control.closest("form") != null;
+    if( tag == "button" ) {
+      if( !in_form ) {
+        buttons.push(control);
+      }
+      continue;
+    }
+    // Textareas inside forms still get an input event
+    if( in_form && tag == "input" ) {
+      continue;
+    }
+    var xpath = getXPath(control);
+    if( !in_form ) {
+      snapshot.ui_forms.sources.push(xpath);
+    }
+    snapshot.events.push(snapshot_event(control, "input", "input", "", xpath));
+  }
+  // Any of these buttons could submit the sources
+  if( snapshot.ui_forms.sources.length > 0 ) {
+    for(var i = 0; i < buttons.length; i++) {
+      snapshot.ui_forms.buttons.push(getXPath(buttons[i]));
+    }
+  }
+
+  // Event handlers set as properties and with addEventListener
+  if( known_docs ) {
+    snapshot.properties = drain_properties(known_docs);
+  } else {
+    snapshot.events = snapshot.events.concat(JSON.parse(catch_properties()));
+  }
+  snapshot.events = snapshot.events.concat(added_events);
+
+  // Bootstrap style buttons
+  var toggles = document.querySelectorAll("button[data-toggle]");
+  for(var i = 0; i < toggles.length; i++) {
+    snapshot.events.push(snapshot_event(toggles[i], "click", "button", "",
+                                        getXPath(toggles[i])));
+  }
+  var fake_buttons = document.getElementsByClassName("btn");
+  for(var i = 0; i < fake_buttons.length; i++) {
+    snapshot.events.push(snapshot_event(fake_buttons[i], "click", "a", "btn",
+                                        getXPath(fake_buttons[i])));
+  }
+
+  return JSON.stringify(snapshot);
+}
+
+function snapshot_event(element, event, tag, html_class, xpath) {
+  return {"function_id": "",
+          "event": event,
+          "id": element.id,
+          "tag": tag,
+          "addr": xpath,
+          "class": html_class};
+}
+
+// FNV-1a over a string, continuing from hash
+function snapshot_hash(hash, str) {
+  for(var i = 0; i < str.length; i++) {
+    hash ^= str.charCodeAt(i);
+    hash = Math.imul(hash, 0x01000193);
+  }
+  return hash;
+}
+
+// Hash of the elements and their attributes, kept until the observer
+// sees a change. dom_state() and the page_snapshot() after a cache miss
+// then only walk the document once.
+var element_hash = {"count": 0, "hash": null};
+var element_hash_observer = new MutationObserver(function() {
+  element_hash.hash = null;
+});
+element_hash_observer.observe(document, {"childList": true, "attributes": true, "subtree": true});
+
+function element_fingerprint() {
+  // Changes made since the last callback are still queued
+  if( element_hash_observer.takeRecords().length > 0 ) {
+    element_hash.hash = null;
+  }
+  if( element_hash.hash === null ) {
+    var hash = 0x811c9dc5;
+    var elems = document.getElementsByTagName("*");
+    for(var i = 0; i < elems.length; i++) {
+      hash = snapshot_hash(hash, "<" + elems[i].tagName);
+      var attributes = elems[i].attributes;
+      for(var j = 0; j < attributes.length; j++) {
+        hash = snapshot_hash(hash, " " + attributes[j].name + "=" + attributes[j].value);
+      }
+    }
+    element_hash.count = elems.length;
+    element_hash.hash = hash;
+  }
+  return element_hash;
+}
+
+// Cheap hash of everything page_snapshot() looks at: every element with
+// its attributes, plus the listeners, window.open calls and handler
+// properties set so far.
+function dom_fingerprint() {
+  var elements = element_fingerprint();
+  var hash = snapshot_hash(elements.hash, "|" + added_events.length + "|" + window_open_urls.length +
+                                          "|" + property_tracker.version);
+  return elements.count + "-" + (hash >>> 0).toString(16);
+}
+
+// Url and fingerprint of the current page, used as the extraction cache key
+function dom_state() {
+  return [document.location.href, dom_fingerprint()];
+}
+
+// Attributes that change what can be crawled from an element. Text,
+// values, ids, classes, styles and data attributes are left out, they
+// change all the time without giving the crawler anything new.
+var state_attributes = ["name", "type", "href", "src", "action", "method", "role",
+                        "hidden", "disabled"];
+
+var state_skipped_tags = {"SCRIPT": true, "STYLE": true, "NOSCRIPT": true, "TEMPLATE": true};
+
+// Structural fingerprint of the page, used to find edges that lead to
+// a state the crawler has already explored. Hashes the element tree
+// (tag and depth of every element) with the attributes above and the
+// names of inline handlers.
+function state_fingerprint() {
+  var hash = 0x811c9dc5;
+  var count = 0;
+  var root = document.documentElement;
+  var el = root;
+  var depth = 0;
+  while( el ) {
+    var skip = state_skipped_tags[el.tagName] === true;
+    if( !skip ) {
+      var str = depth + "<" + el.tagName;
+      for(var i = 0; i < state_attributes.length; i++) {
+        var value = el.getAttribute(state_attributes[i]);
+        if( value !== null ) {
+          str += " " + state_attributes[i] + "=" + value;
+        }
+      }
+      var attributes = el.attributes;
+      for(var i = 0; i < attributes.length; i++) {
+        if( attributes[i].name.lastIndexOf("on", 0) === 0 ) {
+          str += " " + attributes[i].name;
+        }
+      }
+      hash = snapshot_hash(hash, str);
+      count++;
+    }
+
+    // Next element in document order
+    if( !skip && el.firstElementChild ) {
+      el = el.firstElementChild;
+      depth++;
+      continue;
+    }
+    while( el && el !== root && !el.nextElementSibling ) {
+      el = el.parentElement;
+      depth--;
+    }
+    el = (el && el !== root) ? el.nextElementSibling : null;
+  }
+  return count + "-" + (hash >>> 0).toString(16);
+}
+
+// Url and structural fingerprint of the current page
+function page_state() {
+  return [document.location.href, state_fingerprint()];
+}
+
+var snapshot_storages = {"local": "localStorage", "session": "sessionStorage"};
+
+// localStorage and sessionStorage as a JSON string, see restore_storage()
+function storage_snapshot() {
+  var snapshot = {"local": {}, "session": {}};
+  for (var name in snapshot_storages) {
+    try {
+      var storage = window[snapshot_storages[name]];
+      for (var i = 0; i < storage.length; i++) {
+        var key = storage.key(i);
+        snapshot[name][key] = storage.getItem(key);
+      }
+    } catch(e) {
+      // Storage is not available on this page (sandbox, file://)
+    }
+  }
+  return JSON.stringify(snapshot);
+}
+
+// Replaces both storages with a storage_snapshot()
+function restore_storage(json) {
+  var snapshot = JSON.parse(json);
+  for (var name in snapshot_storages) {
+    try {
+      var storage = window[snapshot_storages[name]];
+      storage.clear();
+      for (var key in snapshot[name]) {
+        storage.setItem(key, snapshot[name][key]);
+      }
+    } catch(e) {
+    }
+  }
+}
@@ -16,6 +16,121 @@
  */
 
 
-// This JS-Script wrapps the addEventListener-Function, that is used by JQuery
-timingCallbackWrap(window, "setTimeout", 0, timeoutWrapper);
-timingCallbackWrap(window, "setInterval", 0, intervallWrapper);
\ No newline at end of file
+// Wraps setTimeout and setInterval to keep a queue of the pending timers.
+// flush_timers() runs them in order on a virtual clock, so content that
+// shows up after a delay is there without waiting for it. The timers
+// still run on their own as usual when they are not flushed.
+var virtual_timers = {
+  // Virtual time in ms, the due time of the last flushed timer
+  "now": 0,
+  // Order of timers with the same due time
+  "seq": 0,
+  // real timer id -> {id, callback, args, due, interval, seq}
+  "queue": new Map(),
+  // Runs of one interval per flush, so a short interval (animations,
+  // polling) does not use up max_calls before the later timers run
+  "interval_ticks": 2,
+  "setTimeout": window.setTimeout,
+  "setInterval": window.setInterval,
+  "clearTimeout": window.clearTimeout,
+  "clearInterval": window.clearInterval
+};
+
+function virtual_clock() {
+  return Math.max(Date.now(), virtual_timers.now);
+}
+
+function virtual_timer_delay(delay) {
+  delay = Number(delay) || 0;
+  return Math.min(Math.max(delay, 0), max_waiting_time);
+}
+
+function virtual_timer_run(timer) {
+  try {
+    if (typeof timer.callback === "function") {
+      timer.callback.apply(window, timer.args);
+    } else {
+      // setTimeout("code", ...)
+      window.eval(String(timer.callback));
+    }
+  } catch(e) {
+    console.log("Timer failed: " + e);
+  }
+}
+
+window.setTimeout = function(callback, delay) {
+  var args = Array.prototype.slice.call(arguments, 2);
+  delay = virtual_timer_delay(delay);
+  var timer = {"callback": callback, "args": args, "due": virtual_clock() + delay,
+               "interval": null, "seq": virtual_timers.seq++};
+  timer.id = virtual_timers.setTimeout.call(window, function() {
+    virtual_timers.queue.delete(timer.id);
+    virtual_timer_run(timer);
+  }, delay);
+  virtual_timers.queue.set(timer.id, timer);
+  return timer.id;
+};
+
+window.setInterval = function(callback, delay) {
+  var args = Array.prototype.slice.call(arguments, 2);
+  delay = virtual_timer_delay(delay);
+  var timer = {"callback": callback, "args": args, "due": virtual_clock() + delay,
+               "interval": Math.max(delay, 1), "seq": virtual_timers.seq++};
+  timer.id = virtual_timers.setInterval.call(window, function() {
+    timer.due = virtual_clock() + timer.interval;
+    virtual_timer_run(timer);
+  }, delay);
+  virtual_timers.queue.set(timer.id, timer);
+  return timer.id;
+};
+
+window.clearTimeout = function(id) {
+  virtual_timers.queue.delete(id);
+  return virtual_timers.clearTimeout.call(window, id);
+};
+
+window.clearInterval = function(id) {
+  virtual_timers.queue.delete(id);
+  return virtual_timers.clearInterval.call(window, id);
+};
+
+// Runs every timer due within horizon_ms, earliest first, including the
+// ones scheduled by the timers themselves. Timeouts that ran are removed
+// from the queue and cancelled. Intervals run once per period, at most
+// interval_ticks times, then they are moved past the horizon. At most
+// max_calls callbacks in total. Returns the number of callbacks run.
+function flush_timers(horizon_ms, max_calls) {
+  var limit = virtual_clock() + horizon_ms;
+  var calls = 0;
+  // interval -> runs in this flush
+  var ticks = new Map();
+  while (calls < max_calls) {
+    var next = null;
+    virtual_timers.queue.forEach(function(timer) {
+      if (timer.due <= limit &&
+          (next === null || timer.due < next.due ||
+           (timer.due == next.due && timer.seq < next.seq))) {
+        next = timer;
+      }
+    });
+    if (next === null) {
+      break;
+    }
+
+    virtual_timers.now = Math.max(virtual_timers.now, next.due);
+    if (next.interval === null) {
+      virtual_timers.queue.delete(next.id);
+      virtual_timers.clearTimeout.call(window, next.id);
+    } else {
+      next.due += next.interval;
+      ticks.set(next, (ticks.get(next) || 0) + 1);
+      if (ticks.get(next) >= virtual_timers.interval_ticks && next.due <= limit) {
+        // Next period after the horizon
+        next.due += (Math.floor((limit - next.due) / next.interval) + 1) * next.interval;
+      }
+    }
+    virtual_timer_run(next);
+    calls++;
+  }
+  return calls;
+}